@@ -2,42 +2,267 @@
 """语稿智能整理系统 - Web 应用"""
 
 import os
-import json
-from flask import Flask, request, jsonify, render_template, send_file
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, request, jsonify, render_template, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
+import uuid
 import tempfile
 import shutil
+from pathlib import Path
 
 from script_refine import ScriptRefiner
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """使用 orjson 编解码 JSON（整理结果可达数 MB，orjson 编码中文比标准库快数倍）"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        # 无法直接序列化的类型（日期、dataclass 等）交给 Flask 默认处理
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__, template_folder='templates', static_folder='static')
 CORS(app)
 
+# JSON 序列化：优先 orjson，未安装时使用标准库（不转义中文、不排序键）
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+else:
+    app.json.ensure_ascii = False
+    app.json.sort_keys = False
+
 # 配置
 UPLOAD_FOLDER = tempfile.mkdtemp()
 ALLOWED_EXTENSIONS = {'txt', 'md', 'text'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# 临时上传文件清理配置
+UPLOAD_MAX_AGE = 3600  # 超过该时间（秒）未修改的临时文件会被删除
+UPLOAD_GC_INTERVAL = 1800  # 清理间隔（秒）
+
+# 上传处理结果的预览长度（字符），完整内容通过 /api/download 获取
+PREVIEW_LIMIT = 65536
+
+# 批量处理配置
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 8))  # 单批最多合并的请求数
+BATCH_MAX_LATENCY_MS = int(os.getenv('BATCH_MAX_LATENCY_MS', 20))  # 等待凑批的最长时间（毫秒）
+PROCESS_TIMEOUT = int(os.getenv('PROCESS_TIMEOUT', 600))  # 单个请求等待处理结果的超时（秒）
+
 # 初始化系统
 refiner = None
+dispatcher = None
+_cleanup_started = False
+
+
+class BatchDispatcher:
+    """请求批处理调度器：将短时间窗口内到达的并发请求合并为一次批量处理"""
+    
+    def __init__(self, handler, max_batch: int = 8, max_latency_ms: int = 20):
+        """
+        Args:
+            handler: 批处理函数，签名为 handler(texts, mode) -> 结果列表
+            max_batch: 单批最多合并的请求数
+            max_latency_ms: 等待凑批的最长时间（毫秒）
+        """
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+    
+    def start(self):
+        """启动后台工作线程"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="BatchDispatcher", daemon=True)
+                self._worker.start()
+    
+    def restart_after_fork(self):
+        """fork 后子进程不会继承后台线程，重建队列与锁并重新启动"""
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.start()
+    
+    def submit(self, text: str, mode: str) -> Future:
+        """提交一个处理请求，返回对应的 Future"""
+        future = Future()
+        self._queue.put((text, mode, future))
+        return future
+    
+    def _collect(self):
+        """阻塞获取第一个请求，随后在时间窗口内尽量凑满一批"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+    
+    def _run(self):
+        """工作线程主循环：按处理模式分组后批量处理，并将结果分发回各请求"""
+        while True:
+            groups = {}
+            for text, mode, future in self._collect():
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(mode, []).append((text, future))
+            
+            for mode, group in groups.items():
+                try:
+                    results = self.handler([text for text, _ in group], mode)
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(group, results):
+                    future.set_result(result)
+
 
 def init_refiner(config_path=None):
     """初始化文本整理系统"""
-    global refiner
+    global refiner, dispatcher
     try:
         refiner = ScriptRefiner(config_path=config_path)
+        dispatcher = BatchDispatcher(
+            lambda texts, mode: refiner.process_texts(texts, output_mode=mode),
+            max_batch=BATCH_MAX_SIZE,
+            max_latency_ms=BATCH_MAX_LATENCY_MS
+        )
+        dispatcher.start()
         return True
     except Exception as e:
         print(f"初始化失败: {str(e)}")
         return False
 
+def cleanup_upload_folder(max_age=UPLOAD_MAX_AGE):
+    """删除 UPLOAD_FOLDER 中超过 max_age 秒未修改的残留文件"""
+    now = time.time()
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+def start_upload_cleanup(interval=UPLOAD_GC_INTERVAL, remove_on_exit=True):
+    """
+    启动后台线程，定期清理残留的临时上传文件
+    
+    Args:
+        interval: 清理间隔（秒）
+        remove_on_exit: 进程退出时是否删除整个临时目录（preload 模式下 worker 共享该目录，只由 master 删除）
+    """
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                cleanup_upload_folder()
+            except OSError as e:
+                print(f"清理临时文件失败: {str(e)}")
+    
+    stop_event = threading.Event()
+    threading.Thread(target=run, name="UploadCleanup", daemon=True).start()
+    if remove_on_exit:
+        # 进程退出时删除整个临时目录（fork 出的子进程会继承 atexit 注册，按 pid 区分）
+        atexit.register(remove_upload_folder, os.getpid())
+    atexit.register(stop_event.set)
+
+def remove_upload_folder(owner_pid):
+    """删除临时上传目录，仅在创建目录的进程中执行"""
+    if os.getpid() == owner_pid:
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+def warmup_refiner():
+    """启动预热：加载 jieba 词典；本地模型首次生成会触发 CUDA 初始化（开启 torch_compile 时还有 forward 的编译），也提前完成"""
+    refiner.rewriter.chunker.warmup()
+    if refiner.config.get('llm', {}).get('type') != 'local':
+        return
+    try:
+        refiner.llm.generate("你好", max_tokens=8)
+        print("🔥 模型预热完成")
+    except Exception as e:
+        print(f"模型预热失败: {str(e)}")
+
+def restart_background_tasks():
+    """gunicorn --preload 时系统在 master 中初始化后再 fork 出 worker，需在 worker 中重新启动后台线程"""
+    if dispatcher is not None:
+        dispatcher.restart_after_fork()
+    if _cleanup_started:
+        start_upload_cleanup(remove_on_exit=False)
+
+os.register_at_fork(after_in_child=restart_background_tasks)
+
+def create_app(config_path=None):
+    """应用工厂：每个进程只初始化一次文本整理系统"""
+    global _cleanup_started
+    if refiner is None:
+        if init_refiner(config_path or os.getenv('CONFIG_PATH', None)):
+            warmup_refiner()
+        else:
+            print("警告: 系统初始化失败，请检查配置文件")
+    if not _cleanup_started:
+        start_upload_cleanup()
+        _cleanup_started = True
+    return app
+
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def read_preview(filepath, limit=PREVIEW_LIMIT):
+    """读取文本文件开头用于预览，返回 (内容, 是否被截断)"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read(limit + 1)
+    return content[:limit], len(content) > limit
+
+def parse_upload(temp_files):
+    """
+    流式解析 multipart 请求，上传文件边解析边写入 UPLOAD_FOLDER，不在内存中缓冲
+    
+    Args:
+        temp_files: 用于收集已创建临时文件的列表（由调用方负责关闭和删除）
+        
+    Returns:
+        (form, files)
+    """
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        temp_name = f"{uuid.uuid4().hex}_{secure_filename(filename or '')}"
+        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_name)
+        temp_file = open(temp_path, 'wb+')
+        temp_files.append(temp_file)
+        return temp_file
+    
+    _, form, files = parse_form_data(
+        request.environ,
+        stream_factory=stream_factory,
+        max_content_length=app.config['MAX_CONTENT_LENGTH']
+    )
+    return form, files
+
 @app.route('/')
 def index():
     """主页"""
@@ -64,12 +289,21 @@ def process_text():
         if not refiner:
             return jsonify({'error': '系统未初始化'}), 500
         
-        # 处理文本
-        results = refiner.process_text(
-            text=text,
-            output_mode=mode,
-            show_progress=False
-        )
+        # 相同文本、模式、模型、提示词与处理配置的结果直接从缓存返回（温度过高时结果随机性大，不缓存）
+        cache_key = None
+        results = None
+        if refiner.result_cacheable():
+            cache_key = refiner.cache.make_key(text, mode, *refiner.result_identity())
+            results = refiner.cache.get(cache_key)
+        
+        if results is None:
+            # 处理文本（与同一时间窗口内的其他请求合并批量处理）
+            try:
+                results = dispatcher.submit(text, mode).result(timeout=PROCESS_TIMEOUT)
+            except FutureTimeoutError:
+                return jsonify({'error': '处理超时，请稍后重试'}), 504
+            if cache_key:
+                refiner.cache.set(cache_key, results)
         
         # 准备响应
         response = {
@@ -88,14 +322,50 @@ def process_text():
     except Exception as e:
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
 
+@app.route('/api/process_stream', methods=['POST'])
+def process_text_stream():
+    """流式处理文本 API（Server-Sent Events）"""
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'error': '请求数据为空'}), 400
+    
+    text = data.get('text', '').strip()
+    mode = data.get('mode', 'full')
+    
+    if not text:
+        return jsonify({'error': '文本内容为空'}), 400
+    
+    if mode not in ['full', 'summary', 'both']:
+        return jsonify({'error': '无效的处理模式'}), 400
+    
+    if not refiner:
+        return jsonify({'error': '系统未初始化'}), 500
+    
+    def generate():
+        try:
+            for event in refiner.process_text_stream(text, output_mode=mode):
+                yield f"data: {app.json.dumps(event)}\n\n"
+        except Exception as e:
+            error = {'type': 'error', 'error': f'处理失败: {str(e)}'}
+            yield f"data: {app.json.dumps(error)}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """上传文件 API"""
+    temp_files = []
     try:
-        if 'file' not in request.files:
+        try:
+            form, files = parse_upload(temp_files)
+        except RequestEntityTooLarge:
+            return jsonify({'error': '文件过大，最大支持 16MB'}), 413
+        
+        if 'file' not in files:
             return jsonify({'error': '没有上传文件'}), 400
         
-        file = request.files['file']
+        file = files['file']
         
         if file.filename == '':
             return jsonify({'error': '文件名为空'}), 400
@@ -103,59 +373,64 @@ def upload_file():
         if not allowed_file(file.filename):
             return jsonify({'error': '不支持的文件格式，仅支持 .txt, .md'}), 400
         
-        mode = request.form.get('mode', 'full')
+        mode = form.get('mode', 'full')
+        
+        if mode not in ['full', 'summary', 'both']:
+            return jsonify({'error': '无效的处理模式'}), 400
         
         if not refiner:
             return jsonify({'error': '系统未初始化'}), 500
         
-        # 保存临时文件
-        filename = secure_filename(file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_path)
+        # 上传内容已在解析时写入临时文件，刷新缓冲区后关闭（同一进程随即读取，无需 fsync 落盘）
+        temp_path = file.stream.name
+        file.stream.flush()
+        file.stream.close()
         
-        try:
-            # 处理文件
-            results = refiner.process(
-                input_path=temp_path,
-                output_mode=mode,
-                show_progress=False
+        # 处理文件
+        results = refiner.process(
+            input_path=temp_path,
+            output_mode=mode,
+            show_progress=False
+        )
+        
+        # 准备响应（只返回 Markdown 开头部分用于预览，完整文件通过下载获取）
+        response = {
+            'success': True,
+            'results': {},
+            'truncated': {},
+            'downloads': {}
+        }
+        
+        # 读取处理结果（结果键为 markdown/docx/pdf 与 summary_markdown/summary_docx/summary_pdf）
+        if mode in ('full', 'both'):
+            # 完整版文件
+            response['downloads'].update(
+                {k: v for k, v in results.items() if not k.startswith('summary')}
             )
-            
-            # 准备响应
-            response = {
-                'success': True,
-                'results': {},
-                'downloads': {}
-            }
-            
-            # 读取处理结果
-            if 'full' in mode or 'both' in mode:
-                # 查找完整版文件
-                for format_type, filepath in results.items():
-                    if 'summary' not in format_type:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                        response['results']['full'] = content
-                        response['downloads'][format_type] = filepath
-            
-            if 'summary' in mode or 'both' in mode:
-                # 查找会议纪要文件
-                for format_type, filepath in results.items():
-                    if 'summary' in format_type:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                        response['results']['summary'] = content
-                        response['downloads'][format_type] = filepath
-            
-            return jsonify(response)
+            if 'markdown' in results:
+                response['results']['full'], response['truncated']['full'] = read_preview(results['markdown'])
+        
+        if mode in ('summary', 'both'):
+            # 会议纪要文件
+            response['downloads'].update(
+                {k: v for k, v in results.items() if k.startswith('summary')}
+            )
+            if 'summary_markdown' in results:
+                response['results']['summary'], response['truncated']['summary'] = read_preview(results['summary_markdown'])
         
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        return jsonify(response)
     
     except Exception as e:
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
+    
+    finally:
+        # 清理临时文件
+        for temp_file in temp_files:
+            temp_file.close()
+            try:
+                os.remove(temp_file.name)
+            except FileNotFoundError:
+                pass
 
 @app.route('/api/download')
 def download_file():
@@ -173,20 +448,20 @@ def download_file():
             return jsonify({'error': '系统未初始化'}), 500
         
         output_dir = refiner.config.get('output', {}).get('output_dir', './output')
-        abs_output_dir = os.path.abspath(output_dir)
-        abs_filepath = os.path.abspath(filepath)
-        
-        if not abs_filepath.startswith(abs_output_dir):
+        # 按路径组件比较（字符串前缀比较会误放行 output_xxx 之类的同名前缀目录）
+        if not Path(filepath).resolve().is_relative_to(Path(output_dir).resolve()):
             return jsonify({'error': '无效的文件路径'}), 403
         
-        if not os.path.exists(filepath):
+        # conditional=True 支持 Range / 条件请求，由 Werkzeug 直接流式发送文件
+        try:
+            return send_file(
+                filepath,
+                as_attachment=True,
+                download_name=os.path.basename(filepath),
+                conditional=True
+            )
+        except (FileNotFoundError, PermissionError):
             return jsonify({'error': '文件不存在'}), 404
-        
-        return send_file(
-            filepath,
-            as_attachment=True,
-            download_name=os.path.basename(filepath)
-        )
     
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
@@ -213,41 +488,59 @@ def export_file():
         if not refiner:
             return jsonify({'error': '系统未初始化'}), 500
         
+        # 相同内容已导出过且文件仍存在时直接复用
+        output_dir = refiner.config.get('output', {}).get('output_dir', './output')
+        cache_key = refiner.cache.make_key(content, format_type, mode)
+        cached = refiner.cache.get(cache_key)
+        if cached and os.path.exists(cached['filepath']):
+            return jsonify({
+                'success': True,
+                'filepath': cached['filepath'],
+                'filename': os.path.basename(cached['filepath'])
+            })
+        
         # 使用导出器导出
         filename_template = f"完整版_{{timestamp}}"
         if mode == 'summary':
             filename_template = f"会议纪要_{{timestamp}}"
         
-        # 临时修改导出格式
-        original_formats = refiner.exporter.formats
-        refiner.exporter.formats = [format_type]
+        # 只导出请求的格式（按次传入，不修改多线程共用的导出器配置）
+        exported = refiner.exporter.export(
+            content=content,
+            filename_template=filename_template,
+            mode=mode,
+            formats=[format_type]
+        )
         
-        try:
-            exported = refiner.exporter.export(
-                content=content,
-                filename_template=filename_template,
-                mode=mode
-            )
-            
-            if format_type in exported:
-                filepath = exported[format_type]
-                # 返回相对路径，用于下载
-                output_dir = refiner.config.get('output', {}).get('output_dir', './output')
-                rel_path = os.path.relpath(filepath, output_dir)
-                return jsonify({
-                    'success': True,
-                    'filepath': os.path.join(output_dir, rel_path),
-                    'filename': os.path.basename(filepath)
-                })
-            else:
-                return jsonify({'error': '导出失败'}), 500
-        
-        finally:
-            refiner.exporter.formats = original_formats
+        if format_type in exported:
+            filepath = exported[format_type]
+            # 返回相对路径，用于下载
+            rel_path = os.path.relpath(filepath, output_dir)
+            download_path = os.path.join(output_dir, rel_path)
+            refiner.cache.set(cache_key, {'filepath': download_path})
+            return jsonify({
+                'success': True,
+                'filepath': download_path,
+                'filename': os.path.basename(filepath)
+            })
+        else:
+            return jsonify({'error': '导出失败'}), 500
     
     except Exception as e:
         return jsonify({'error': f'导出失败: {str(e)}'}), 500
 
+@app.route('/api/cache/clear', methods=['POST'])
+def clear_cache():
+    """清空结果缓存 API"""
+    if not refiner:
+        return jsonify({'error': '系统未初始化'}), 500
+    
+    try:
+        removed = refiner.cache.clear()
+        return jsonify({'success': True, 'removed': removed})
+    except Exception as e:
+        return jsonify({'error': f'清空缓存失败: {str(e)}'}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
@@ -256,17 +549,58 @@ def health_check():
         'initialized': refiner is not None
     })
 
+def gunicorn_command(port, config_path=None):
+    """构建 gunicorn 启动命令，按 LLM 类型选择进程/线程数"""
+    try:
+        llm_type = ScriptRefiner._load_config(config_path).get('llm', {}).get('type', 'online')
+    except FileNotFoundError:
+        llm_type = 'online'
+    
+    if llm_type == 'local':
+        # 本地模型独占 GPU，只能由单个进程加载，改用多线程（模型推理由 LocalLLM 内部加锁串行执行，
+        # 其余线程用于上传解析、下载与健康检查等请求）；
+        # CUDA 在 fork 前初始化会导致子进程不可用，因此不使用 preload
+        workers, threads, preload = 1, 16, False
+    else:
+        # 在线 API 为 I/O 密集型，多进程 + 多线程；
+        # preload 在 master 中初始化一次（配置、jieba 词典等），worker 通过写时复制共享
+        workers, threads, preload = 2 * (os.cpu_count() or 1) + 1, 8, True
+    workers = int(os.getenv('WORKERS', workers))
+    threads = int(os.getenv('THREADS', threads))
+    preload = os.getenv('SR_PRELOAD', str(preload)).lower() in ('1', 'true')
+    
+    command = [
+        'gunicorn',
+        '-w', str(workers),
+        '-k', 'gthread',
+        '--threads', str(threads),
+        '-b', f'0.0.0.0:{port}',
+        '--timeout', str(PROCESS_TIMEOUT),
+        '--chdir', os.path.dirname(os.path.abspath(__file__)),
+    ]
+    if preload:
+        command.append('--preload')
+    command.append('app:create_app()')
+    return command
+
+# 以 app:app 方式由其他 WSGI 服务器加载时，可设置 SR_PRELOAD=1 在导入时完成初始化
+if __name__ != '__main__' and os.getenv('SR_PRELOAD', '').lower() in ('1', 'true'):
+    create_app()
+
 if __name__ == '__main__':
-    # 初始化系统
     config_path = os.getenv('CONFIG_PATH', None)
-    if not init_refiner(config_path):
-        print("警告: 系统初始化失败，请检查配置文件")
-    
-    # 启动服务器
     port = int(os.getenv('PORT', 8080))  # 默认使用 8080 端口，避免与 macOS AirPlay 冲突
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
     
     print(f"🚀 启动 Web 服务器，访问 http://localhost:{port}")
     print(f"💡 提示: 如需更改端口，请设置环境变量 PORT=端口号")
-    app.run(host='0.0.0.0', port=port, debug=debug)
-
+    
+    if debug or shutil.which('gunicorn') is None:
+        # 调试模式或未安装 gunicorn（如 Windows）时使用 Flask 开发服务器
+        create_app(config_path)
+        app.run(host='0.0.0.0', port=port, debug=debug)
+    else:
+        # 生产模式：由 gunicorn 接管进程（preload 时在 master 中初始化一次，否则各 worker 各自初始化）
+        command = gunicorn_command(port, config_path)
+        print(f"⚙️ 使用 gunicorn: {' '.join(command[1:])}")
+        os.execvp('gunicorn', command)
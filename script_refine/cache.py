@@ -0,0 +1,135 @@
+"""结果缓存模块"""
+
+import os
+import json
+import time
+import logging
+import hashlib
+import tempfile
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("ScriptRefine.Cache")
+
+
+class ResultCache:
+    """基于内容哈希的磁盘结果缓存"""
+    
+    DEFAULT_TTL = 86400  # 配置未指定 ttl 时的缓存有效期（秒）
+    
+    def __init__(self, config: Dict, cache_dir: str):
+        """
+        Args:
+            config: 缓存配置（enabled, ttl）
+            cache_dir: 缓存目录
+        """
+        self.config = config
+        self.enabled = config.get("enabled", True)
+        self.ttl = config.get("ttl", self.DEFAULT_TTL)  # 秒，0 表示永不过期
+        self.cache_dir = cache_dir
+        
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.purge_expired()
+    
+    @staticmethod
+    def make_key(*parts) -> str:
+        """根据各组成部分计算缓存键（sha256）"""
+        return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Any]:
+        """
+        读取缓存
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            缓存的值，未命中或已过期时返回 None
+        """
+        if not self.enabled:
+            return None
+        
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def set(self, key: str, value: Any):
+        """
+        写入缓存（先写临时文件再原子替换，避免并发读到半截内容）
+        
+        Args:
+            key: 缓存键
+            value: 可 JSON 序列化的值
+        """
+        if not self.enabled:
+            return
+        
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.cache_dir, suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+            tmp_path = None
+        except (OSError, TypeError, ValueError) as e:
+            # 磁盘错误或值无法 JSON 序列化时只放弃缓存，不影响调用方
+            logger.warning(f"⚠️ 写入缓存失败: {str(e)}")
+        finally:
+            # 未能替换到位的临时文件（写入中途出错）直接删除
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+    
+    def purge_expired(self) -> int:
+        """
+        删除已过期的缓存文件
+        
+        Returns:
+            删除的缓存文件数
+        """
+        if not self.ttl or not os.path.isdir(self.cache_dir):
+            return 0
+        
+        now = time.time()
+        removed = 0
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".json") and now - entry.stat().st_mtime > self.ttl:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+    
+    def clear(self) -> int:
+        """
+        清空缓存
+        
+        Returns:
+            删除的缓存文件数
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
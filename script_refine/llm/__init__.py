@@ -1,7 +1,7 @@
 """LLM 接口模块"""
 
 from .base import BaseLLM
-from .factory import create_llm
+from .factory import create_llm, create_llm_cascade
 
-__all__ = ["BaseLLM", "create_llm"]
+__all__ = ["BaseLLM", "create_llm", "create_llm_cascade"]
 
@@ -1,16 +1,91 @@
 """LLM 基础接口"""
 
+import re
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 
 
+# 连续的中文字符（CJK 统一表意文字），按整段匹配后累加长度，比逐字匹配更快
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]+')
+
+# 删除中文字符的转换表，长度差即中文字符数
+_DROP_CJK = dict.fromkeys(range(0x4e00, 0xa000))
+
+
+def _count_cjk_regex(text: str) -> int:
+    """统计中文字符数（正则整段匹配）"""
+    return sum(map(len, _CJK_RE.findall(text)))
+
+
+def _count_cjk_translate(text: str) -> int:
+    """统计中文字符数（str.translate 删除中文后比较长度）"""
+    return len(text) - len(text.translate(_DROP_CJK))
+
+
+def _make_count_cjk_numpy():
+    """numpy 向量化实现（可选依赖，未安装时返回 None）"""
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    
+    def _count_cjk_numpy(text: str) -> int:
+        """统计中文字符数（按 UTF-32 码点向量化比较；surrogatepass 使孤立代理字符也能编码，不会抛出异常）"""
+        codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        return int(np.count_nonzero((codes >= 0x4e00) & (codes <= 0x9fff)))
+    
+    return _count_cjk_numpy
+
+
+def _pick_fastest(candidates, sample: str):
+    """启动时对各实现做一次微基准测试，返回最快的实现"""
+    best, best_time = candidates[0], float("inf")
+    for func in candidates:
+        start = time.perf_counter()
+        for _ in range(3):
+            func(sample)
+        elapsed = time.perf_counter() - start
+        if elapsed < best_time:
+            best, best_time = func, elapsed
+    return best
+
+
+# 统计中文字符数。各实现快慢与中英文比例及文本长度有关，以中英混排的典型语稿为样本选择
+count_cjk = _pick_fastest(
+    [f for f in (_count_cjk_regex, _count_cjk_translate, _make_count_cjk_numpy()) if f],
+    "大家好，今天我们召开 2024 年度工作会议，主要讨论 AI 项目的进展。" * 200
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算 token 数量：中文约 1.5 字符/token，其他约 4 字符/token
+    
+    Args:
+        text: 输入文本
+        
+    Returns:
+        估算的 token 数量
+    """
+    chinese_chars = count_cjk(text)
+    other_chars = len(text) - chinese_chars
+    return int(chinese_chars / 1.5 + other_chars / 4)
+
+
 class BaseLLM(ABC):
     """LLM 基础抽象类"""
     
+    # generate_batch 是否为真正的批量推理（一次前向计算处理多个提示词），
+    # 默认实现只是并发调用 generate
+    native_batch = False
+    
     def __init__(self, config: Dict):
         self.config = config
         self.temperature = config.get("temperature", 0.3)
         self.max_tokens = config.get("max_tokens", 4000)
+        self.max_concurrency = config.get("max_concurrency", 8)
     
     @abstractmethod
     def generate(self, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
@@ -40,6 +115,30 @@ class BaseLLM(ABC):
         """
         pass
     
+    def generate_batch(self, prompts: List[str], system_prompt: Optional[str] = None, **kwargs) -> List[str]:
+        """
+        批量生成文本
+        
+        默认实现使用线程池并发调用 generate（适用于 I/O 密集的 API 调用），
+        子类可覆盖以使用真正的批量推理。
+        
+        Args:
+            prompts: 用户提示词列表
+            system_prompt: 系统提示词（所有提示词共用，可选）
+            **kwargs: 其他参数
+            
+        Returns:
+            生成的文本列表，顺序与 prompts 一致
+        """
+        if not prompts:
+            return []
+        
+        if len(prompts) == 1 or self.max_concurrency <= 1:
+            return [self.generate(p, system_prompt, **kwargs) for p in prompts]
+        
+        with ThreadPoolExecutor(max_workers=min(len(prompts), self.max_concurrency)) as executor:
+            return list(executor.map(lambda p: self.generate(p, system_prompt, **kwargs), prompts))
+    
     def generate_stream(self, prompt: str, system_prompt: Optional[str] = None, **kwargs):
         """
         流式生成文本（可选实现）
@@ -1,6 +1,6 @@
 """LLM 工厂类"""
 
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from .base import BaseLLM
 from .online import OnlineLLM
 from .local import LocalLLM
@@ -25,3 +25,26 @@ def create_llm(config: Dict) -> BaseLLM:
     else:
         raise ValueError(f"不支持的 LLM 类型: {llm_type}")
 
+
+def create_llm_cascade(config: Dict) -> Tuple[Optional[BaseLLM], BaseLLM]:
+    """
+    根据配置创建分级路由所需的 (快速模型, 主模型)
+    
+    快速模型由 cascade.fast_type 指定使用哪一段模型配置（local 或 online），
+    未启用分级路由、或快速模型与主模型类型相同时，快速模型为 None。
+    
+    Args:
+        config: LLM 配置字典
+        
+    Returns:
+        (快速模型或 None, 主模型)
+    """
+    strong_llm = create_llm(config)
+    
+    cascade_config = config.get("cascade", {})
+    fast_type = cascade_config.get("fast_type", "local")
+    if not cascade_config.get("enabled", False) or fast_type == config.get("type", "online"):
+        return None, strong_llm
+    
+    fast_llm = create_llm({"type": fast_type, fast_type: config.get(fast_type, {})})
+    return fast_llm, strong_llm
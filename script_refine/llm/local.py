@@ -1,13 +1,30 @@
 """本地 LLM 实现"""
 
-from typing import Optional, Dict
+import json
+import threading
+import importlib.util
+from typing import Optional, Dict, List
 import torch
-from .base import BaseLLM
+from .base import BaseLLM, estimate_tokens
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
 
 
 class LocalLLM(BaseLLM):
     """本地 LLM 封装"""
     
+    # 各模型的对话模板（{sys} 为系统提示词，{user} 为用户提示词）
+    _TEMPLATES = {
+        "qwen2.5": "<|im_start|>system\n{sys}<|im_end|>\n<|im_start|>user\n{user}<|im_end|>\n<|im_start|>assistant\n",
+        "chatglm": "[Round 1]\n\n问：{sys}\n{user}\n\n答：",
+    }
+    _DEFAULT_TEMPLATE = "{sys}\n\n{user}\n\n"
+    
     def __init__(self, config: Dict):
         super().__init__(config)
         self.provider = config.get("provider", "qwen2.5")
@@ -15,11 +32,23 @@ class LocalLLM(BaseLLM):
         self.model_name = config.get("model_name", "")  # Ollama 模型名称
         self.device = config.get("device", "auto")
         self.max_length = config.get("max_length", 4096)
+        self.torch_compile = config.get("torch_compile", False)
+        self.quantization = config.get("quantization", "none")  # nf4, int8, none
         self.ollama_base_url = config.get("ollama_base_url", "http://localhost:11434")
+        self._format_prompt = self._TEMPLATES.get(self.provider, self._DEFAULT_TEMPLATE).format
         self._model = None
         self._tokenizer = None
+        self._session = None
         self._use_ollama = False
         self._init_model()
+        if not self._use_ollama:
+            # 同一模型实例不支持多线程并发 generate，改用 generate_batch 批量推理
+            self.max_concurrency = 1
+            self.native_batch = True
+        # Web 服务的多个请求线程共用同一实例：generate 串行执行；
+        # tokenizer 调用会切换填充/截断设置，另用一把锁（只在 tokenize 期间持有，不等待生成结束）
+        self._generate_lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
     
     def _init_model(self):
         """初始化本地模型"""
@@ -30,16 +59,27 @@ class LocalLLM(BaseLLM):
                 # 默认使用 qwen3:8b
                 self.model_name = "qwen3:8b"
             print(f"使用 Ollama 模型: {self.model_name}")
+            if requests is None:
+                raise ImportError("使用 Ollama 需要安装 requests: pip install requests")
+            
+            # 复用连接（HTTP keep-alive），避免每次生成都重新建立 TCP 连接
+            self._session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=8,
+                pool_maxsize=32,
+                max_retries=Retry(total=2, backoff_factor=0.2)
+            )
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._session.headers["Connection"] = "keep-alive"
+            
             # 测试连接
             try:
-                import requests
-                response = requests.get(f"{self.ollama_base_url}/api/tags", timeout=5)
+                response = self._ollama("GET", "/api/tags", timeout=5)
                 if response.status_code == 200:
                     print("✅ Ollama 连接成功")
                 else:
                     raise RuntimeError(f"Ollama API 响应错误: {response.status_code}")
-            except ImportError:
-                raise ImportError("使用 Ollama 需要安装 requests: pip install requests")
             except Exception as e:
                 raise RuntimeError(f"无法连接到 Ollama: {str(e)}，请确保 Ollama 服务正在运行")
             return
@@ -63,19 +103,31 @@ class LocalLLM(BaseLLM):
             print(f"正在加载模型: {self.model_path} (设备: {self.device})")
             self._tokenizer = AutoTokenizer.from_pretrained(
                 self.model_path,
-                trust_remote_code=True
+                trust_remote_code=True,
+                use_fast=True
             )
             self._model = AutoModelForCausalLM.from_pretrained(
                 self.model_path,
                 trust_remote_code=True,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                device_map=self.device if self.device == "cuda" else None,
+                **self._model_load_kwargs()
             )
             
             if self.device == "cpu":
                 self._model = self._model.to(self.device)
             
             self._model.eval()
+            
+            # pad_token_id 只需设置一次，避免每次 generate 传参（批量推理时也用于填充）
+            if self._tokenizer.pad_token is None:
+                self._tokenizer.pad_token = self._tokenizer.eos_token
+            self._model.generation_config.pad_token_id = self._tokenizer.pad_token_id
+            
+            if self.torch_compile:
+                # generate 的解码循环无法整体编译，只编译 forward；静态 KV cache 使每步解码的张量形状固定，
+                # reduce-overhead 才能复用 CUDA graph（新的批大小或缓存长度首次出现时会重新编译）
+                self._model.generation_config.cache_implementation = "static"
+                self._model.forward = torch.compile(self._model.forward, mode="reduce-overhead", fullgraph=True)
+            
             print("模型加载完成")
             
         except ImportError:
@@ -83,57 +135,172 @@ class LocalLLM(BaseLLM):
         except Exception as e:
             raise RuntimeError(f"模型加载失败: {str(e)}")
     
+    def _model_load_kwargs(self) -> Dict:
+        """模型加载参数：GPU 上优先使用 bf16 与 FlashAttention-2"""
+        if self.device != "cuda":
+            return {"torch_dtype": torch.float32, "low_cpu_mem_usage": True}
+        
+        load_kwargs = {
+            # bf16 与 fp16 显存占用相同，但不易溢出；旧显卡不支持时回退 fp16
+            "torch_dtype": torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16,
+            "device_map": "auto",
+            "low_cpu_mem_usage": True,
+        }
+        # FlashAttention-2 需要额外安装 flash-attn
+        if importlib.util.find_spec("flash_attn") is not None:
+            load_kwargs["attn_implementation"] = "flash_attention_2"
+        
+        # 量化加载（需要安装 bitsandbytes）：nf4 约为 fp16 显存的 1/4，int8 约为 1/2
+        if self.quantization in ("nf4", "int8"):
+            from transformers import BitsAndBytesConfig
+            if self.quantization == "nf4":
+                load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=load_kwargs["torch_dtype"],
+                    bnb_4bit_use_double_quant=True,
+                )
+            else:
+                load_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+        elif self.quantization != "none":
+            raise ValueError(f"不支持的量化方式: {self.quantization}")
+        
+        return load_kwargs
+    
+    def _generation_kwargs(self, **kwargs) -> Dict:
+        """生成参数：温度为 0 时使用贪心解码，跳过 softmax 采样与 top-p/top-k 过滤"""
+        temperature = kwargs.get("temperature", self.temperature)
+        do_sample = temperature > 0
+        generation_kwargs = {
+            "max_new_tokens": kwargs.get("max_tokens", self.max_tokens),
+            "do_sample": do_sample,
+            "num_beams": 1,
+        }
+        if do_sample:
+            # 采样时只传调用方显式给出的 top_p / top_k，其余沿用模型 generation_config 中的默认值
+            generation_kwargs["temperature"] = temperature
+            for key in ("top_p", "top_k"):
+                if key in kwargs:
+                    generation_kwargs[key] = kwargs[key]
+        else:
+            # 贪心解码时将温度与 top_p 置为不生效的值（不传 top_k，避免 transformers 每次调用都提示无效参数）
+            generation_kwargs["temperature"] = 1.0
+            generation_kwargs["top_p"] = 1.0
+        return generation_kwargs
+    
     def generate(self, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
         """生成文本"""
         # 使用 Ollama
         if self._use_ollama:
             return self._generate_ollama(prompt, system_prompt, **kwargs)
         
-        # 使用 transformers
+        # 使用 transformers（解码与生成流水线并行）
+        return "".join(self._stream_transformers(prompt, system_prompt, **kwargs)).strip()
+    
+    def generate_batch(self, prompts: List[str], system_prompt: Optional[str] = None, **kwargs) -> List[str]:
+        """批量生成文本（transformers 下使用左填充，所有提示词共享一次 generate）"""
+        # Ollama 为 HTTP 调用，使用默认的并发实现
+        if self._use_ollama or len(prompts) <= 1:
+            return super().generate_batch(prompts, system_prompt, **kwargs)
+        
         if not self._model or not self._tokenizer:
             raise RuntimeError("模型未初始化")
         
-        # 构建完整提示词
-        full_prompt = prompt
-        if system_prompt:
-            if self.provider == "qwen2.5":
-                full_prompt = f"<|im_start|>system\n{system_prompt}<|im_end|>\n<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"
-            elif self.provider == "chatglm":
-                full_prompt = f"[Round 1]\n\n问：{system_prompt}\n{prompt}\n\n答："
-            else:
-                full_prompt = f"{system_prompt}\n\n{prompt}\n\n"
+        full_prompts = [self._build_full_prompt(p, system_prompt) for p in prompts]
         
-        # Tokenize
-        inputs = self._tokenizer(
-            full_prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=self.max_length
-        ).to(self.device)
-        
-        # 生成
-        with torch.no_grad():
+        # 生成式模型批量推理需要左填充，使各序列的生成起点对齐（在锁内切换，不影响其他线程）
+        with self._tokenizer_lock:
+            padding_side = self._tokenizer.padding_side
+            self._tokenizer.padding_side = "left"
+            try:
+                inputs = self._tokenizer(
+                    full_prompts,
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length
+                ).to(self.device)
+            finally:
+                self._tokenizer.padding_side = padding_side
+        
+        with self._generate_lock, torch.no_grad():
             outputs = self._model.generate(
                 **inputs,
-                max_new_tokens=kwargs.get("max_tokens", self.max_tokens),
-                temperature=kwargs.get("temperature", self.temperature),
-                do_sample=True,
-                pad_token_id=self._tokenizer.eos_token_id,
+                **self._generation_kwargs(**kwargs)
             )
         
-        # Decode
-        generated_text = self._tokenizer.decode(
-            outputs[0][inputs["input_ids"].shape[1]:],
-            skip_special_tokens=True
-        )
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            self._tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
+    
+    def _build_full_prompt(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """按模型格式拼接系统提示词与用户提示词"""
+        if not system_prompt:
+            return prompt
+        return self._format_prompt(sys=system_prompt, user=prompt)
+    
+    def generate_stream(self, prompt: str, system_prompt: Optional[str] = None, **kwargs):
+        """流式生成文本（逐段返回生成内容）"""
+        if self._use_ollama:
+            yield from self._stream_ollama(prompt, system_prompt, **kwargs)
+        else:
+            yield from self._stream_transformers(prompt, system_prompt, **kwargs)
+    
+    def _stream_transformers(self, prompt: str, system_prompt: Optional[str] = None, **kwargs):
+        """使用 transformers 流式生成：generate 在后台线程运行，当前线程边生成边解码"""
+        if not self._model or not self._tokenizer:
+            raise RuntimeError("模型未初始化")
+        
+        from transformers import TextIteratorStreamer
+        
+        # 构建完整提示词
+        full_prompt = self._build_full_prompt(prompt, system_prompt)
+        
+        # Tokenize
+        with self._tokenizer_lock:
+            inputs = self._tokenizer(
+                full_prompt,
+                return_tensors="pt",
+                truncation=True,
+                max_length=self.max_length
+            ).to(self.device)
+        
+        streamer = TextIteratorStreamer(self._tokenizer, skip_prompt=True, skip_special_tokens=True)
+        error = []
+        
+        def run():
+            try:
+                # 锁由生成线程持有到 generate 结束（调用方中途停止读取时生成仍会跑完，锁不会提前释放）
+                with self._generate_lock, torch.no_grad():
+                    self._model.generate(
+                        **inputs,
+                        **self._generation_kwargs(**kwargs),
+                        streamer=streamer
+                    )
+            except Exception as e:
+                error.append(e)
+                # 生成中途出错时结束流，避免调用方一直等待
+                streamer.end()
         
-        return generated_text.strip()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+        
+        if error:
+            raise RuntimeError(f"生成失败: {str(error[0])}")
     
     def _generate_ollama(self, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
         """使用 Ollama 生成文本"""
+        return "".join(self._stream_ollama(prompt, system_prompt, **kwargs)).strip()
+    
+    def _stream_ollama(self, prompt: str, system_prompt: Optional[str] = None, **kwargs):
+        """使用 Ollama 流式生成文本，逐段产出生成内容"""
         try:
-            import requests
-            
             # 构建消息
             messages = []
             if system_prompt:
@@ -144,43 +311,56 @@ class LocalLLM(BaseLLM):
             payload = {
                 "model": self.model_name,
                 "messages": messages,
-                "stream": False,
+                "stream": True,
                 "options": {
                     "temperature": kwargs.get("temperature", self.temperature),
                     "num_predict": kwargs.get("max_tokens", self.max_tokens),
                 }
             }
             
-            response = requests.post(
-                f"{self.ollama_base_url}/api/chat",
-                json=payload,
-                timeout=300  # 5分钟超时
-            )
-            
-            if response.status_code != 200:
-                raise RuntimeError(f"Ollama API 错误: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            return result.get("message", {}).get("content", "").strip()
+            # 默认 5 分钟超时（两次数据之间的最长等待）
+            with self._ollama("POST", "/api/chat", json=payload, stream=True) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"Ollama API 错误: {response.status_code} - {response.text}")
+                
+                # 每行是一个 JSON 对象，done=true 表示生成结束
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    content = chunk.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                    if chunk.get("done"):
+                        break
         
-        except ImportError:
-            raise ImportError("使用 Ollama 需要安装 requests: pip install requests")
         except Exception as e:
             raise RuntimeError(f"Ollama 生成失败: {str(e)}")
     
+    def _ollama(self, method: str, path: str, **kwargs):
+        """
+        发送 Ollama API 请求
+        
+        Args:
+            method: HTTP 方法
+            path: API 路径（如 /api/chat）
+            **kwargs: 传给 requests 的其他参数，timeout 默认 300 秒
+            
+        Returns:
+            requests.Response
+        """
+        kwargs.setdefault("timeout", 300)
+        return self._session.request(method, f"{self.ollama_base_url}{path}", **kwargs)
+    
     def count_tokens(self, text: str) -> int:
         """计算 token 数量"""
-        if self._use_ollama:
-            # Ollama 使用简单估算
-            chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-            other_chars = len(text) - chinese_chars
-            return int(chinese_chars / 1.5 + other_chars / 4)
-        
-        if not self._tokenizer:
-            # 如果没有 tokenizer，使用简单估算
-            chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-            other_chars = len(text) - chinese_chars
-            return int(chinese_chars / 1.5 + other_chars / 4)
-        
-        return len(self._tokenizer.encode(text))
+        if self._use_ollama or not self._tokenizer:
+            # Ollama 或没有 tokenizer 时使用简单估算
+            return estimate_tokens(text)
+        
+        # 不添加特殊 token；重复文本的计数由 TextChunker 缓存
+        with self._tokenizer_lock:
+            return len(self._tokenizer(text, add_special_tokens=False)["input_ids"])
 
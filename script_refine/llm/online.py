@@ -1,8 +1,9 @@
 """在线 LLM API 实现"""
 
 import os
-from typing import Optional, Dict
-from .base import BaseLLM
+import asyncio
+from typing import Optional, Dict, List
+from .base import BaseLLM, estimate_tokens
 
 
 class OnlineLLM(BaseLLM):
@@ -17,8 +18,25 @@ class OnlineLLM(BaseLLM):
         if not self.api_key:
             raise ValueError(f"未找到 {self.provider} 的 API 密钥，请在配置文件中设置或设置环境变量")
         self.base_url = config.get("base_url")
+        self.max_retries = config.get("max_retries", 2)  # SDK 内置重试次数
         self._client = None
         self._init_client()
+        # 按提供商绑定生成实现，避免每次调用都分支判断
+        self._generate_impl = {
+            "openai": self._generate_openai,
+            "deepseek": self._generate_openai,
+            "siliconflow": self._generate_openai,
+            "qianwen": self._generate_qianwen,
+            "zhipu": self._generate_zhipu,
+            "anthropic": self._generate_anthropic,
+        }[self.provider]
+        # 支持异步客户端的提供商，批量生成时使用协程并发
+        self._agenerate_impl = {
+            "openai": self._agenerate_openai,
+            "deepseek": self._agenerate_openai,
+            "siliconflow": self._agenerate_openai,
+            "anthropic": self._agenerate_anthropic,
+        }.get(self.provider)
     
     def _get_api_key(self) -> str:
         """从环境变量获取 API 密钥"""
@@ -39,7 +57,7 @@ class OnlineLLM(BaseLLM):
             try:
                 from openai import OpenAI
                 # OpenAI 支持自定义 base_url（用于代理或其他兼容服务）
-                client_kwargs = {"api_key": self.api_key}
+                client_kwargs = {"api_key": self.api_key, "max_retries": self.max_retries}
                 if self.base_url:
                     client_kwargs["base_url"] = self.base_url
                 self._client = OpenAI(**client_kwargs)
@@ -51,7 +69,8 @@ class OnlineLLM(BaseLLM):
                 from openai import OpenAI
                 self._client = OpenAI(
                     api_key=self.api_key,
-                    base_url="https://api.deepseek.com/v1"
+                    base_url="https://api.deepseek.com/v1",
+                    max_retries=self.max_retries
                 )
             except ImportError:
                 raise ImportError("请安装 openai: pip install openai")
@@ -70,7 +89,8 @@ class OnlineLLM(BaseLLM):
                         base_url = base_url.rstrip("/") + "/v1"
                 self._client = OpenAI(
                     api_key=self.api_key,
-                    base_url=base_url
+                    base_url=base_url,
+                    max_retries=self.max_retries
                 )
             except ImportError:
                 raise ImportError("请安装 openai: pip install openai")
@@ -93,7 +113,7 @@ class OnlineLLM(BaseLLM):
         elif self.provider == "anthropic":
             try:
                 from anthropic import Anthropic
-                self._client = Anthropic(api_key=self.api_key)
+                self._client = Anthropic(api_key=self.api_key, max_retries=self.max_retries)
             except ImportError:
                 raise ImportError("请安装 anthropic: pip install anthropic")
         
@@ -102,16 +122,7 @@ class OnlineLLM(BaseLLM):
     
     def generate(self, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
         """生成文本"""
-        if self.provider in ["openai", "deepseek", "siliconflow"]:
-            return self._generate_openai(prompt, system_prompt, **kwargs)
-        elif self.provider == "qianwen":
-            return self._generate_qianwen(prompt, system_prompt, **kwargs)
-        elif self.provider == "zhipu":
-            return self._generate_zhipu(prompt, system_prompt, **kwargs)
-        elif self.provider == "anthropic":
-            return self._generate_anthropic(prompt, system_prompt, **kwargs)
-        else:
-            raise ValueError(f"不支持的提供商: {self.provider}")
+        return self._generate_impl(prompt, system_prompt, **kwargs)
     
     def _generate_openai(self, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
         """OpenAI/DeepSeek API"""
@@ -171,7 +182,81 @@ class OnlineLLM(BaseLLM):
         response = self._client.messages.create(
             model=self.model,
             messages=messages,
-            system=system_prompt or "",
+            system=self._anthropic_system(system_prompt),
+            temperature=kwargs.get("temperature", self.temperature),
+            max_tokens=kwargs.get("max_tokens", self.max_tokens),
+        )
+        return response.content[0].text
+    
+    @staticmethod
+    def _anthropic_system(system_prompt: Optional[str]):
+        """
+        Anthropic 系统提示词：标记为可缓存的前缀（cache_control），
+        多个分片共用同一系统提示词时由服务端复用缓存
+        """
+        if not system_prompt:
+            return ""
+        return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+    
+    def generate_batch(self, prompts: List[str], system_prompt: Optional[str] = None, **kwargs) -> List[str]:
+        """批量生成文本（OpenAI 兼容接口与 Anthropic 使用异步客户端并发，其余使用线程池）"""
+        if self._agenerate_impl is None or len(prompts) <= 1 or self.max_concurrency <= 1:
+            return super().generate_batch(prompts, system_prompt, **kwargs)
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._agenerate_many(prompts, system_prompt, **kwargs))
+        # 已处于事件循环中（无法嵌套 asyncio.run），回退为线程池
+        return super().generate_batch(prompts, system_prompt, **kwargs)
+    
+    async def _agenerate_many(self, prompts: List[str], system_prompt: Optional[str] = None, **kwargs) -> List[str]:
+        """并发生成，最多同时发出 max_concurrency 个请求，结果顺序与 prompts 一致"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 异步客户端绑定到当前事件循环，每次批量调用单独创建并在结束时关闭
+        async with self._create_async_client() as client:
+            async def run(prompt: str) -> str:
+                async with semaphore:
+                    return await self._agenerate_impl(client, prompt, system_prompt, **kwargs)
+            
+            return list(await asyncio.gather(*(run(p) for p in prompts)))
+    
+    def _create_async_client(self):
+        """创建与同步客户端配置一致的异步客户端"""
+        if self.provider == "anthropic":
+            from anthropic import AsyncAnthropic
+            return AsyncAnthropic(api_key=self.api_key, max_retries=self.max_retries)
+        
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=str(self._client.base_url),
+            max_retries=self.max_retries
+        )
+    
+    async def _agenerate_openai(self, client, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
+        """OpenAI/DeepSeek API（异步）"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=kwargs.get("temperature", self.temperature),
+            max_tokens=kwargs.get("max_tokens", self.max_tokens),
+        )
+        return response.choices[0].message.content
+    
+    async def _agenerate_anthropic(self, client, prompt: str, system_prompt: Optional[str] = None, **kwargs) -> str:
+        """Anthropic Claude API（异步）"""
+        messages = [{"role": "user", "content": prompt}]
+        
+        response = await client.messages.create(
+            model=self.model,
+            messages=messages,
+            system=self._anthropic_system(system_prompt),
             temperature=kwargs.get("temperature", self.temperature),
             max_tokens=kwargs.get("max_tokens", self.max_tokens),
         )
@@ -179,8 +264,5 @@ class OnlineLLM(BaseLLM):
     
     def count_tokens(self, text: str) -> int:
         """估算 token 数量（简单实现）"""
-        # 简单估算：中文约 1.5 字符/token，英文约 4 字符/token
-        chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-        other_chars = len(text) - chinese_chars
-        return int(chinese_chars / 1.5 + other_chars / 4)
+        return estimate_tokens(text)
 
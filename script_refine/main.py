@@ -1,16 +1,34 @@
 """语稿智能整理系统主模块"""
 
 import os
+import copy
+import json
+import hashlib
 import yaml
-from typing import Optional, Dict
+from functools import lru_cache
+from typing import Optional, Dict, List
 from pathlib import Path
 from dotenv import load_dotenv
 
-from .llm import create_llm
+from .llm import create_llm_cascade
 from .text_processor import TextCleaner
 from .rewriter import TextRewriter
 from .summarizer import MeetingSummarizer
 from .output import DocumentExporter
+from .cache import ResultCache
+
+# 优先使用 libyaml 的 C 实现解析配置，未编译 libyaml 时回退为纯 Python 实现
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+
+@lru_cache(maxsize=8)
+def _parse_yaml_cached(abs_path: str, mtime: float) -> Dict:
+    """解析 YAML 配置文件（按路径与修改时间缓存，文件修改后自动重新解析）"""
+    with open(abs_path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_YamlLoader) or {}
 
 
 class ScriptRefiner:
@@ -30,29 +48,94 @@ class ScriptRefiner:
         self.config = self._load_config(config_path)
         
         # 初始化组件
-        self.llm = create_llm(self.config.get("llm", {}))
+        # fast_llm 仅在启用分级路由（llm.cascade）时创建，用于先行重写各分片
+        self.fast_llm, self.llm = create_llm_cascade(self.config.get("llm", {}))
         text_processing_config = self.config.get("text_processing", {})
         self.cleaner = TextCleaner(text_processing_config.get("cleaning", {}))
         chunking_config = text_processing_config.get("chunking", {})
         # 将 speaker_detection 配置添加到 chunking_config 中
         chunking_config["speaker_detection"] = text_processing_config.get("speaker_detection", {})
+        self.exporter = DocumentExporter(self.config.get("output", {}))
+        self.cache = ResultCache(
+            self.config.get("cache", {}),
+            os.path.join(self.exporter.output_dir, ".cache")
+        )
         self.rewriter = TextRewriter(self.llm, {
             "chunking": chunking_config,
             "prompts": self.config.get("prompts", {}),
             "logging": self.config.get("logging", {}),
+            "cascade": self.config.get("llm", {}).get("cascade", {}),
             "temperature": self.config.get("llm", {}).get("online", {}).get("temperature", 0.3),
             "max_tokens": self.config.get("llm", {}).get("online", {}).get("max_tokens", 4000),
-        })
+        }, cache=self.cache, cache_namespace=self.llm_identity(), fast_llm=self.fast_llm)
         self.summarizer = MeetingSummarizer(self.llm, {
             "prompts": self.config.get("prompts", {}),
             "output": self.config.get("output", {}),
             "logging": self.config.get("logging", {}),
             "temperature": self.config.get("llm", {}).get("online", {}).get("temperature", 0.3),
             "max_tokens": self.config.get("llm", {}).get("online", {}).get("max_tokens", 4000),
-        })
-        self.exporter = DocumentExporter(self.config.get("output", {}))
+        }, cache=self.cache, cache_namespace=self.llm_identity())
+        self._result_identity = self._build_result_identity()
+    
+    def close(self):
+        """释放资源（关闭重写器与纪要生成器的日志文件）"""
+        self.rewriter.close()
+        self.summarizer.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def llm_identity(self) -> tuple:
+        """当前 LLM 的标识（提供商、模型、温度），用于结果缓存键；启用分级路由时附加快速模型的标识"""
+        llm_config = self.config.get("llm", {})
+        identity = self._model_identity(llm_config.get(llm_config.get("type", "online"), {}))
+        if self.fast_llm:
+            cascade_config = llm_config.get("cascade", {})
+            identity += ("cascade",) + self._model_identity(llm_config.get(cascade_config.get("fast_type", "local"), {})) + (
+                cascade_config.get("min_ratio", 0.5),
+                cascade_config.get("max_ratio", 3.0),
+            )
+        return identity
+    
+    def result_identity(self) -> tuple:
+        """完整处理结果的标识，用于整体结果缓存键：模型标识 + 影响输出的提示词模板、文本处理配置与 max_tokens 的摘要"""
+        return self._result_identity
+    
+    def result_cacheable(self) -> bool:
+        """整体结果是否可以缓存：与分片缓存一致，温度高于 TextRewriter._CACHE_MAX_TEMPERATURE 时输出随机性较大，不缓存"""
+        temperature = self.rewriter.config.get("temperature", 0.3)
+        return self.cache.enabled and temperature <= TextRewriter._CACHE_MAX_TEMPERATURE
+    
+    def _build_result_identity(self) -> tuple:
+        """计算 result_identity（配置与提示词模板在初始化后不再变化，只计算一次）"""
+        settings = {
+            "rewrite_prompt": self.rewriter.rewrite_prompt,
+            "summary_prompt": self.summarizer.summary_prompt,
+            "summary_structure": self.summarizer.structure,
+            "text_processing": self.config.get("text_processing", {}),
+            "rewrite_max_tokens": self.rewriter.config.get("max_tokens"),
+            "summary_max_tokens": self.summarizer.config.get("max_tokens"),
+        }
+        digest = hashlib.sha256(
+            json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+        return self.llm_identity() + (digest,)
+    
+    @staticmethod
+    def _model_identity(model_config: Dict) -> tuple:
+        """单个模型配置的标识（提供商、模型、温度）"""
+        model = model_config.get("model") or model_config.get("model_name") or model_config.get("model_path", "")
+        return (
+            model_config.get("provider", ""),
+            model,
+            model_config.get("temperature", 0.3),
+        )
 
-    def _load_config(self, config_path: Optional[str]) -> Dict:
+    @staticmethod
+    def _load_config(config_path: Optional[str]) -> Dict:
         """
         按优先级加载配置文件：
         1. 显式传入的 config_path
@@ -74,10 +157,10 @@ class ScriptRefiner:
 
         for path in candidates:
             if path and os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    cfg = yaml.safe_load(f)
+                cfg = _parse_yaml_cached(os.path.abspath(path), os.path.getmtime(path))
                 print(f"📂 使用配置文件: {path}")
-                return cfg or {}
+                # 返回副本：调用方会修改配置字典，不能影响缓存内容
+                return copy.deepcopy(cfg)
 
         raise FileNotFoundError(
             "未找到配置文件，请创建 config_local.yaml，或提供 --config 参数，"
@@ -160,25 +243,13 @@ class ScriptRefiner:
         return results
     
     def _read_input(self, input_path: str) -> str:
-        """读取输入文件"""
-        path = Path(input_path)
-        
-        if not path.exists():
+        """读取输入文件（按 UTF-8 文本读取，.txt/.md 与其他扩展名处理方式相同）"""
+        try:
+            return Path(input_path).read_text(encoding='utf-8')
+        except FileNotFoundError:
             raise FileNotFoundError(f"文件不存在: {input_path}")
-        
-        # 根据扩展名选择读取方式
-        suffix = path.suffix.lower()
-        
-        if suffix in [".txt", ".md"]:
-            with open(path, 'r', encoding='utf-8') as f:
-                return f.read()
-        else:
-            # 尝试作为文本文件读取
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as e:
-                raise ValueError(f"无法读取文件: {str(e)}")
+        except (UnicodeDecodeError, OSError) as e:
+            raise ValueError(f"无法读取文件: {str(e)}") from e
     
     def process_text(
         self,
@@ -223,4 +294,74 @@ class ScriptRefiner:
             results["summary"] = summary_text
         
         return results
-
+    
+    def process_text_stream(self, text: str, output_mode: str = "full"):
+        """
+        流式处理文本，边生成边产出事件
+        
+        Args:
+            text: 输入文本
+            output_mode: 输出模式
+            
+        Yields:
+            事件字典：
+            - {"type": "token", "stage": "full" 或 "summary", "content": 生成片段, ...}
+            - {"type": "done", "results": {"full": "...", "summary": "..."}}（最后一个事件）
+        """
+        if not text:
+            raise ValueError("输入文本为空")
+        
+        cleaned_text = self.cleaner.clean(text)
+        results = {}
+        
+        if output_mode in ["full", "both"]:
+            for event in self.rewriter.rewrite_stream(cleaned_text):
+                if event["type"] == "result":
+                    results["full"] = event["content"]
+                else:
+                    yield {**event, "stage": "full"}
+        
+        if output_mode in ["summary", "both"]:
+            source_text = results["full"] if output_mode == "both" else cleaned_text
+            for event in self.summarizer.summarize_stream(source_text):
+                if event["type"] == "result":
+                    results["summary"] = event["content"]
+                else:
+                    yield {**event, "stage": "summary"}
+        
+        yield {"type": "done", "results": results}
+    
+    def process_texts(self, texts: List[str], output_mode: str = "full") -> List[Dict[str, str]]:
+        """
+        批量处理多段文本，各阶段的 LLM 调用合并为批量请求
+        
+        Args:
+            texts: 输入文本列表
+            output_mode: 输出模式
+            
+        Returns:
+            处理后的文本字典列表，顺序与 texts 一致
+        """
+        if not texts or not all(texts):
+            raise ValueError("输入文本为空")
+        
+        print(f"📊 批量处理 {len(texts)} 段文本")
+        
+        # Web 端批量请求也走这里：在当前进程中清洗，不启动进程池
+        cleaned_texts = self.cleaner.clean_batch(texts, workers=1)
+        results = [{} for _ in texts]
+        rewritten_texts = None
+        
+        if output_mode in ["full", "both"]:
+            print("✍️ 开始批量文本重写...")
+            rewritten_texts = self.rewriter.rewrite_batch(cleaned_texts)
+            for result, rewritten_text in zip(results, rewritten_texts):
+                result["full"] = rewritten_text
+        
+        if output_mode in ["summary", "both"]:
+            print("📋 开始批量生成会议纪要...")
+            source_texts = rewritten_texts if output_mode == "both" else cleaned_texts
+            for result, summary_text in zip(results, self.summarizer.summarize_batch(source_texts)):
+                result["summary"] = summary_text
+        
+        return results
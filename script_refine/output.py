@@ -1,10 +1,90 @@
 """文档输出模块"""
 
 import os
-from datetime import datetime
-from typing import Dict, Optional
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+from .utils import fast_timestamp
+
+
+# 编号标题（如“一、”“2.”）
+_CN_HEADING = re.compile(r'^(?:[一二三四五六七八九十]+|\d+)[、.]')
+
+
+# Markdown 分块写入的大小（字符）
+_WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_lines(content: str):
+    """逐行产出文本（与 split('\\n') 结果相同，但不一次性生成整个行列表）"""
+    start = 0
+    while True:
+        end = content.find('\n', start)
+        if end == -1:
+            yield content[start:]
+            return
+        yield content[start:end]
+        start = end + 1
+
+
+@lru_cache(maxsize=1)
+def _load_docx():
+    """按需导入 python-docx（只在首次导出 Word 时导入一次）"""
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    return Document, Pt, WD_PARAGRAPH_ALIGNMENT
+
+
+@lru_cache(maxsize=1)
+def _load_reportlab():
+    """按需导入 reportlab 并注册中文字体（只在首次导出 PDF 时执行一次）"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.lib.enums import TA_LEFT
+    
+    # 尝试注册中文字体（如果可用）
+    try:
+        # 尝试使用系统字体
+        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+        pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
+        chinese_font = 'STSong-Light'
+    except:
+        chinese_font = 'Helvetica'
+    
+    return A4, getSampleStyleSheet, ParagraphStyle, SimpleDocTemplate, Paragraph, Spacer, TA_LEFT, chinese_font
+
+
+def _classify_line(line: str) -> Tuple[Optional[int], str]:
+    """
+    判断一行（非空且已去除首尾空白）是否为标题
+    
+    Args:
+        line: 文本行
+        
+    Returns:
+        (标题级别, 标题文本)，普通段落的级别为 None
+    """
+    if line[0] == '#':
+        # Markdown 标题
+        if line.startswith('### '):
+            return 3, line[4:]
+        if line.startswith('## '):
+            return 2, line[3:]
+        if line.startswith('# '):
+            return 1, line[2:]
+    elif line[0] == '【' and line[-1] == '】':
+        # 讲话人标记，作为标题
+        return 2, line
+    if _CN_HEADING.match(line):
+        # 编号标题
+        return 2, line
+    return None, line
+
 
 class DocumentExporter:
     """文档导出器"""
@@ -17,7 +97,8 @@ class DocumentExporter:
         # 确保输出目录存在
         os.makedirs(self.output_dir, exist_ok=True)
     
-    def export(self, content: str, filename_template: str, mode: str = "full") -> Dict[str, str]:
+    def export(self, content: str, filename_template: str, mode: str = "full",
+               formats: Optional[List[str]] = None) -> Dict[str, str]:
         """
         导出文档
         
@@ -25,43 +106,50 @@ class DocumentExporter:
             content: 文档内容
             filename_template: 文件名模板（支持 {timestamp} 占位符）
             mode: 导出模式（full 或 summary）
+            formats: 本次导出的格式（可选），默认为配置中的 formats；
+                     多线程共用同一导出器时按次传入，不要修改 self.formats
             
         Returns:
             导出文件路径字典 {format: filepath}
         """
-        # 生成文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_filename = filename_template.format(timestamp=timestamp)
-        base_name = os.path.splitext(base_filename)[0]
+        base_name = self._base_name(filename_template)
+        formats = self.formats if formats is None else formats
         
         exported_files = {}
         
         # 导出各种格式
-        if "markdown" in self.formats:
+        if "markdown" in formats:
             md_path = self._export_markdown(content, base_name)
             if md_path:
                 exported_files["markdown"] = md_path
         
-        if "docx" in self.formats:
+        if "docx" in formats:
             docx_path = self._export_docx(content, base_name)
             if docx_path:
                 exported_files["docx"] = docx_path
         
-        if "pdf" in self.formats:
+        if "pdf" in formats:
             pdf_path = self._export_pdf(content, base_name)
             if pdf_path:
                 exported_files["pdf"] = pdf_path
         
         return exported_files
     
+    def _base_name(self, filename_template: str) -> str:
+        """根据文件名模板生成不含扩展名的文件名"""
+        base_filename = filename_template.format(timestamp=fast_timestamp())
+        return os.path.splitext(base_filename)[0]
+    
     def _export_markdown(self, content: str, base_name: str) -> Optional[str]:
         """导出 Markdown"""
         try:
             filename = f"{base_name}.md"
             filepath = os.path.join(self.output_dir, filename)
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # 分块编码写入，避免一次性生成整篇文稿的编码副本
+            with open(filepath, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                for i in range(0, len(content), _WRITE_CHUNK_SIZE):
+                    f.write(content[i:i + _WRITE_CHUNK_SIZE])
             
             return filepath
         except Exception as e:
@@ -71,10 +159,7 @@ class DocumentExporter:
     def _export_docx(self, content: str, base_name: str) -> Optional[str]:
         """导出 Word 文档"""
         try:
-            from docx import Document
-            from docx.shared import Pt
-            from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-            import re
+            Document, Pt, WD_PARAGRAPH_ALIGNMENT = _load_docx()
             
             doc = Document()
             
@@ -85,10 +170,9 @@ class DocumentExporter:
             font.size = Pt(12)
             
             # 解析内容
-            lines = content.split('\n')
             current_paragraph = None
             
-            for line in lines:
+            for line in _iter_lines(content):
                 line = line.strip()
                 
                 if not line:
@@ -97,33 +181,13 @@ class DocumentExporter:
                         current_paragraph = None
                     continue
                 
-                # 检查是否是标题（讲话人标记或一级标题）
-                if line.startswith('【') and line.endswith('】'):
-                    # 讲话人标记，作为标题
-                    p = doc.add_heading(line, level=2)
+                # 检查是否是标题（讲话人标记、编号标题或 Markdown 标题）
+                level, text = _classify_line(line)
+                if level is not None:
+                    p = doc.add_heading(text, level=level)
                     p.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
                     current_paragraph = None
                 
-                elif re.match(r'^[一二三四五六七八九十]+[、.]', line) or re.match(r'^\d+[、.]', line):
-                    # 编号标题
-                    p = doc.add_heading(line, level=2)
-                    current_paragraph = None
-                
-                elif line.startswith('# '):
-                    # Markdown 一级标题
-                    p = doc.add_heading(line[2:], level=1)
-                    current_paragraph = None
-                
-                elif line.startswith('## '):
-                    # Markdown 二级标题
-                    p = doc.add_heading(line[3:], level=2)
-                    current_paragraph = None
-                
-                elif line.startswith('### '):
-                    # Markdown 三级标题
-                    p = doc.add_heading(line[4:], level=3)
-                    current_paragraph = None
-                
                 else:
                     # 普通段落
                     if current_paragraph is None:
@@ -151,14 +215,8 @@ class DocumentExporter:
     def _export_pdf(self, content: str, base_name: str) -> Optional[str]:
         """导出 PDF 文档"""
         try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-            from reportlab.lib.units import inch
-            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-            from reportlab.pdfbase import pdfmetrics
-            from reportlab.pdfbase.ttfonts import TTFont
-            from reportlab.lib.enums import TA_LEFT, TA_CENTER
-            import re
+            (A4, getSampleStyleSheet, ParagraphStyle, SimpleDocTemplate,
+             Paragraph, Spacer, TA_LEFT, chinese_font) = _load_reportlab()
             
             filename = f"{base_name}.pdf"
             filepath = os.path.join(self.output_dir, filename)
@@ -176,15 +234,6 @@ class DocumentExporter:
             # 样式
             styles = getSampleStyleSheet()
             
-            # 尝试注册中文字体（如果可用）
-            try:
-                # 尝试使用系统字体
-                from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-                pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
-                chinese_font = 'STSong-Light'
-            except:
-                chinese_font = 'Helvetica'
-            
             # 自定义样式
             normal_style = ParagraphStyle(
                 'CustomNormal',
@@ -209,9 +258,8 @@ class DocumentExporter:
             
             # 构建内容
             story = []
-            lines = content.split('\n')
             
-            for line in lines:
+            for line in _iter_lines(content):
                 line = line.strip()
                 
                 if not line:
@@ -219,29 +267,9 @@ class DocumentExporter:
                     continue
                 
                 # 检查是否是标题
-                if line.startswith('【') and line.endswith('】'):
-                    # 讲话人标记
-                    story.append(Paragraph(line, heading_style))
-                    story.append(Spacer(1, 6))
-                
-                elif re.match(r'^[一二三四五六七八九十]+[、.]', line) or re.match(r'^\d+[、.]', line):
-                    # 编号标题
-                    story.append(Paragraph(line, heading_style))
-                    story.append(Spacer(1, 6))
-                
-                elif line.startswith('# '):
-                    # Markdown 一级标题
-                    story.append(Paragraph(line[2:], heading_style))
-                    story.append(Spacer(1, 6))
-                
-                elif line.startswith('## '):
-                    # Markdown 二级标题
-                    story.append(Paragraph(line[3:], heading_style))
-                    story.append(Spacer(1, 6))
-                
-                elif line.startswith('### '):
-                    # Markdown 三级标题
-                    story.append(Paragraph(line[4:], heading_style))
+                level, text = _classify_line(line)
+                if level is not None:
+                    story.append(Paragraph(text, heading_style))
                     story.append(Spacer(1, 6))
                 
                 else:
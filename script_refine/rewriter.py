@@ -1,25 +1,88 @@
 """文本重写模块"""
 
+import io
 import os
+import time
+import random
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Optional
 from tqdm import tqdm
 from .llm import BaseLLM
 from .text_processor import TextChunker
+from .cache import ResultCache
+from .utils import fast_timestamp, remove_reasoning_markers, read_prompt_file
+
+# 系统提示词
+_SYSTEM_PROMPT = """你是一位专业的文本整理专家，擅长将语音识别文本转换为高质量、正式、结构清晰的书面文稿。
+你的任务是：
+- 准确理解原文内容
+- 修正所有错误和不规范之处
+- 保持原意不变
+- 输出正式、流畅的书面语
+- **必须完整输出所有内容，不要遗漏任何部分，不要截断内容**"""
+
+# 默认重写提示词模板（未配置 rewrite_prompt 时使用）。
+# 固定的要求说明在前、各分片不同的内容（讲话人、分片位置、原文）在后，
+# 使各分片的提示词共享尽可能长的前缀，便于服务端前缀缓存（KV cache）复用
+_DEFAULT_REWRITE_TEMPLATE = """请将下方的语音识别文本进行专业整理和重写，要求：
+
+1. **逐句纠错**：修正错别字、语法错误、识别错误
+2. **语义补全**：补全不完整的句子，确保语义完整
+3. **专业术语纠正**：纠正专业术语、人名、地名、机构名
+4. **去口语化**：将口语化表达转换为正式书面语
+5. **逻辑优化**：优化句子结构，使表达更清晰流畅
+6. **保持原意**：不改变原讲话人的核心内容和观点
+7. **保持结构**：保留段落结构和讲话人信息（如果有）
+8. **完整输出**：**必须完整输出所有内容，不要遗漏任何句子或段落，不要截断内容**
+
+**重要提示**：
+- 这是文本的一部分，请完整处理并输出所有内容
+- 如果这是多部分文本的一部分，请保持与前后文的连贯性
+- 必须输出完整的整理结果，不要因为长度限制而截断{speaker_info}{context_info}
+
+原始文本：
+{text}
+
+请输出整理后的文本（直接输出文本，不要添加额外说明）："""
 
 
 class TextRewriter:
     """文本重写器"""
     
-    def __init__(self, llm: BaseLLM, config: Dict):
+    _RATE_LIMIT_RETRIES = 3  # 限流时的最大重试次数
+    _CACHE_MAX_TEMPERATURE = 0.3  # 温度高于该值时输出随机性较大，不缓存分片结果
+    _OVERLAP_MIN = 50  # 相邻分片去重的最小重叠字符数
+    _OVERLAP_WINDOW = 200  # 只在上一段末尾与当前段开头的该长度范围内寻找重叠
+    _ESCALATE_MARKERS = ("抱歉", "无法")  # 快速模型输出含这些词时视为不可靠，交给主模型
+    
+    def __init__(self, llm: BaseLLM, config: Dict, cache: Optional[ResultCache] = None,
+                 cache_namespace: tuple = (), fast_llm: Optional[BaseLLM] = None):
+        """
+        Args:
+            llm: LLM 实例（主模型）
+            config: 重写配置
+            cache: 分片结果缓存（可选），相同提示词再次处理时直接返回缓存结果
+            cache_namespace: 缓存键前缀（如提供商与模型），区分不同模型的结果
+            fast_llm: 快速模型（可选），设置后各分片先由它处理，输出可疑时再交给主模型
+        """
         self.llm = llm
+        self.fast_llm = fast_llm
+        cascade_config = config.get("cascade", {})
+        self.cascade_min_ratio = cascade_config.get("min_ratio", 0.5)
+        self.cascade_max_ratio = cascade_config.get("max_ratio", 3.0)
         self.config = config
+        self.cache = cache
+        self.cache_namespace = cache_namespace
         self.chunker = TextChunker(
             config.get("chunking", {}),
-            llm=llm
+            llm=llm,
+            cache=cache,
+            cache_namespace=cache_namespace
         )
         self.rewrite_prompt = self._load_prompt(config.get("prompts", {}).get("rewrite_prompt", ""))
+        # 提示词模板只在初始化时确定一次，每个分片只做变量替换
+        self._format_prompt = (self.rewrite_prompt or _DEFAULT_REWRITE_TEMPLATE).format
         
         # 初始化日志
         self.logger = self._init_logger(config.get("logging", {}))
@@ -35,6 +98,15 @@ class TextRewriter:
         Returns:
             重写后的文本
         """
+        # 短文本无需切片：直接请求一次，跳过切片、合并与去重
+        if self.chunker.fits(text):
+            if self.logger:
+                self.logger.info("📦 文本无需分片，直接重写")
+            result = self._rewrite_chunk(self.chunker.whole_chunk(text), 0, 1)
+            if self.logger:
+                self.logger.info(f"✅ 重写完成，共处理 1 个分片，最终结果长度: {len(result)} 字符")
+            return result
+        
         # 切片
         chunks = self.chunker.chunk(text)
         
@@ -49,14 +121,32 @@ class TextRewriter:
                                 f"讲话人={chunk.get('speaker', '无')}, "
                                 f"位置={chunk.get('start_idx', 0)}-{chunk.get('end_idx', 0)}")
         
-        # 逐块重写
-        rewritten_chunks = []
-        iterator = tqdm(chunks, desc="重写文本") if show_progress else chunks
-        
-        for i, chunk in enumerate(iterator):
-            rewritten = self._rewrite_chunk(chunk, i, len(chunks))
-            if rewritten:
-                rewritten_chunks.append(rewritten)
+        if self.llm.native_batch:
+            # 支持真正批量推理的模型（如 transformers 本地模型）一次处理所有分片（配置快速模型时先批量走快速模型）
+            rewritten_chunks = self._rewrite_chunk_lists([chunks])[0]
+        else:
+            # 内容与讲话人都相同的分片（如重复的开场白）只请求一次，结果复用到所有出现位置
+            # （"第 i 部分"的位置提示只用于保持连贯，不影响重写结果）
+            positions = {}  # (分片内容, 讲话人) -> 分片序号列表
+            for i, chunk in enumerate(chunks):
+                positions.setdefault((chunk["text"], chunk.get("speaker")), []).append(i)
+            
+            # 并发重写各分片（各分片的 LLM 调用互不依赖），结果按原顺序存放
+            results = [None] * len(chunks)
+            max_workers = max(1, min(len(positions), self.llm.max_concurrency))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._rewrite_chunk, chunks[indices[0]], indices[0], len(chunks)): indices
+                    for indices in positions.values()
+                }
+                iterator = as_completed(futures)
+                if show_progress:
+                    iterator = tqdm(iterator, total=len(futures), desc="重写文本")
+                for future in iterator:
+                    for i in futures[future]:
+                        results[i] = future.result()
+            
+            rewritten_chunks = [r for r in results if r]
         
         # 合并结果
         result = self._merge_chunks(rewritten_chunks)
@@ -75,60 +165,61 @@ class TextRewriter:
         prompt = self._build_prompt(text, speaker, chunk_idx, total_chunks)
         system_prompt = self._get_system_prompt()
         
-        # 记录分片信息
-        if self.logger:
-            self.logger.info(f"\n{'='*80}")
-            self.logger.info(f"🔄 处理分片 {chunk_idx + 1}/{total_chunks}")
-            self.logger.info(f"{'='*80}")
-            self.logger.info(f"📝 原始分片内容 ({len(text)} 字符):")
-            self.logger.info(f"{'-'*80}")
-            # 记录完整内容（不截断）
-            self.logger.info(text)
-            self.logger.info(f"{'-'*80}")
-            self.logger.info(f"👤 讲话人: {speaker if speaker else '无'}")
-            self.logger.info(f"📋 系统提示词:")
-            self.logger.info(f"{'-'*80}")
-            self.logger.info(system_prompt)
-            self.logger.info(f"{'-'*80}")
-            self.logger.info(f"💬 用户提示词 ({len(prompt)} 字符):")
-            self.logger.info(f"{'-'*80}")
-            # 记录完整提示词（不截断）
-            self.logger.info(prompt)
-            self.logger.info(f"{'-'*80}")
+        # 记录分片信息（合并为一条日志：减少加锁与写入次数，并发处理时各分片内容也不会交错）
+        if self.logger and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("\n".join([
+                f"\n{'='*80}",
+                f"🔄 处理分片 {chunk_idx + 1}/{total_chunks}",
+                f"{'='*80}",
+                f"📝 原始分片内容 ({len(text)} 字符):",
+                f"{'-'*80}",
+                text,  # 记录完整内容（不截断）
+                f"{'-'*80}",
+                f"👤 讲话人: {speaker if speaker else '无'}",
+                "📋 系统提示词:",
+                f"{'-'*80}",
+                system_prompt,
+                f"{'-'*80}",
+                f"💬 用户提示词 ({len(prompt)} 字符):",
+                f"{'-'*80}",
+                prompt,  # 记录完整提示词（不截断）
+                f"{'-'*80}",
+            ]))
+        
+        # 相同提示词已处理过时直接返回缓存结果
+        cache_key = self._chunk_cache_key(system_prompt, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if self.logger:
+                    self.logger.info(f"♻️ 命中分片缓存 ({len(cached)} 字符)")
+                return cached
         
         # 调用 LLM
         try:
             if self.logger:
                 self.logger.info("⏳ 正在调用 LLM 生成...")
             
-            rewritten = self.llm.generate(
-                prompt,
-                system_prompt=system_prompt,
-                temperature=self.config.get("temperature", 0.3),
-                max_tokens=self.config.get("max_tokens", 4000),
-            )
-            
-            # 移除 LLM 推理标记
-            rewritten = self._remove_reasoning_markers(rewritten)
-            
-            # 保留讲话人标记
-            if speaker:
-                speaker_marker = f"【{speaker}】\n\n" if not rewritten.startswith("【") else ""
-                if speaker_marker and not rewritten.startswith(speaker_marker):
-                    rewritten = speaker_marker + rewritten
-            
-            result = rewritten.strip()
+            if self.fast_llm:
+                result = self._generate_cascade(text, speaker, prompt, system_prompt)
+            else:
+                rewritten = self._generate_with_backoff(prompt, system_prompt)
+                result = self._postprocess_chunk(rewritten, speaker)
             
             # 记录输出结果
             log_chunks = self.config.get("logging", {}).get("log_chunks", True)
-            if self.logger and log_chunks:
-                self.logger.info(f"✅ LLM 生成完成 ({len(result)} 字符)")
-                self.logger.info(f"📤 输出结果:")
-                self.logger.info(f"{'-'*80}")
-                # 记录完整输出结果（不截断）
-                self.logger.info(result)
-                self.logger.info(f"{'-'*80}")
-                self.logger.info(f"{'='*80}\n")
+            if self.logger and log_chunks and self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("\n".join([
+                    f"✅ LLM 生成完成 ({len(result)} 字符)",
+                    "📤 输出结果:",
+                    f"{'-'*80}",
+                    result,  # 记录完整输出结果（不截断）
+                    f"{'-'*80}",
+                    f"{'='*80}\n",
+                ]))
+            
+            if cache_key:
+                self.cache.set(cache_key, result)
             
             return result
         
@@ -142,6 +233,250 @@ class TextRewriter:
             # 出错时返回原文
             return text
     
+    def _chunk_cache_key(self, system_prompt: str, prompt: str) -> Optional[str]:
+        """分片结果的缓存键，未启用缓存或温度过高时返回 None"""
+        if self.cache is None or not self.cache.enabled:
+            return None
+        temperature = self.config.get("temperature", 0.3)
+        if temperature > self._CACHE_MAX_TEMPERATURE:
+            return None
+        return self.cache.make_key(
+            "rewrite_chunk", *self.cache_namespace,
+            system_prompt, prompt, temperature, self.config.get("max_tokens", 4000)
+        )
+    
+    def _generate_cascade(self, text: str, speaker: Optional[str], prompt: str, system_prompt: str) -> str:
+        """先用快速模型重写分片，输出可疑（长度异常或含拒答用语）或出错时改用主模型"""
+        result = self._generate_fast(text, speaker, prompt, system_prompt)
+        if result is not None:
+            return result
+        rewritten = self._generate_with_backoff(prompt, system_prompt)
+        return self._postprocess_chunk(rewritten, speaker)
+    
+    def _generate_fast(self, text: str, speaker: Optional[str], prompt: str, system_prompt: str) -> Optional[str]:
+        """用快速模型重写分片，输出可疑或出错时返回 None（由调用方改用主模型）"""
+        try:
+            rewritten = self._generate_with_backoff(prompt, system_prompt, llm=self.fast_llm)
+            result = self._postprocess_chunk(rewritten, speaker)
+            if not self._needs_escalation(text, result):
+                return result
+            reason = "输出可疑"
+        except Exception as e:
+            reason = f"出错: {str(e)}"
+        
+        if self.logger:
+            self.logger.info(f"⤴️ 快速模型{reason}，改用主模型重写")
+        return None
+    
+    def _needs_escalation(self, text: str, result: str) -> bool:
+        """判断快速模型的输出是否需要交给主模型重做"""
+        ratio = len(result) / max(len(text), 1)
+        if ratio < self.cascade_min_ratio or ratio > self.cascade_max_ratio:
+            return True
+        return any(marker in result and marker not in text for marker in self._ESCALATE_MARKERS)
+    
+    def _generate_with_backoff(self, prompt: str, system_prompt: str, llm: Optional[BaseLLM] = None) -> str:
+        """调用 LLM（默认为主模型），遇到限流（HTTP 429）时按指数退避重试"""
+        llm = llm or self.llm
+        max_retries = self._RATE_LIMIT_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                return llm.generate(
+                    prompt,
+                    system_prompt=system_prompt,
+                    temperature=self.config.get("temperature", 0.3),
+                    max_tokens=self.config.get("max_tokens", 4000),
+                )
+            except Exception as e:
+                rate_limited = getattr(e, "status_code", None) == 429 or "429" in str(e)
+                if not rate_limited or attempt == max_retries:
+                    raise
+                delay = 2 ** attempt + random.random()
+                if self.logger:
+                    self.logger.warning(f"⚠️ 触发限流，{delay:.1f} 秒后重试 ({attempt + 1}/{max_retries})")
+                time.sleep(delay)
+    
+    def rewrite_stream(self, text: str):
+        """
+        流式重写文本，逐段产出 LLM 生成内容
+        
+        Args:
+            text: 原始文本
+            
+        Yields:
+            事件字典：
+            - {"type": "token", "chunk": 分片序号, "total": 分片总数, "content": 生成片段}
+            - {"type": "result", "content": 合并后的完整结果}（最后一个事件）
+        """
+        chunks = self.chunker.chunk(text)
+        system_prompt = self._get_system_prompt()
+        rewritten_chunks = []
+        
+        if self.logger:
+            self.logger.info(f"📦 文本已分割为 {len(chunks)} 个分片（流式重写）")
+        
+        for i, chunk in enumerate(chunks):
+            prompt = self._build_prompt(chunk["text"], chunk.get("speaker"), i, len(chunks))
+            if self.fast_llm:
+                # 快速模型整段生成后先检查输出，合格时作为一个片段产出，可疑或出错时再流式调用主模型，
+                # 避免已推送给客户端的快速模型输出被主模型结果替换
+                rewritten = self._generate_fast(chunk["text"], chunk.get("speaker"), prompt, system_prompt)
+                if rewritten is not None:
+                    yield {"type": "token", "chunk": i, "total": len(chunks), "content": rewritten}
+                    if rewritten:
+                        rewritten_chunks.append(rewritten)
+                    continue
+            
+            pieces = []
+            try:
+                for piece in self.llm.generate_stream(
+                    prompt,
+                    system_prompt=system_prompt,
+                    temperature=self.config.get("temperature", 0.3),
+                    max_tokens=self.config.get("max_tokens", 4000),
+                ):
+                    pieces.append(piece)
+                    yield {"type": "token", "chunk": i, "total": len(chunks), "content": piece}
+                rewritten = self._postprocess_chunk("".join(pieces), chunk.get("speaker"))
+            
+            except Exception as e:
+                error_msg = f"重写切片 {i + 1}/{len(chunks)} 时出错: {str(e)}"
+                if self.logger:
+                    self.logger.error(error_msg)
+                else:
+                    print(error_msg)
+                # 出错时返回原文
+                rewritten = chunk["text"]
+            
+            if rewritten:
+                rewritten_chunks.append(rewritten)
+        
+        yield {"type": "result", "content": self._merge_chunks(rewritten_chunks)}
+    
+    def rewrite_batch(self, texts: List[str]) -> List[str]:
+        """
+        批量重写多段文本，所有文本的分片合并为一次 LLM 批量调用
+        
+        Args:
+            texts: 原始文本列表
+            
+        Returns:
+            重写后的文本列表，顺序与 texts 一致
+        """
+        chunk_lists = [self.chunker.chunk(text) for text in texts]
+        
+        if self.logger:
+            self.logger.info(f"📦 批量重写 {len(texts)} 段文本，共 {sum(map(len, chunk_lists))} 个分片")
+        
+        return [self._merge_chunks(chunks) for chunks in self._rewrite_chunk_lists(chunk_lists)]
+    
+    def _rewrite_chunk_lists(self, chunk_lists: List[List[Dict]]) -> List[List[str]]:
+        """
+        通过一次 llm.generate_batch 调用重写多组分片（已缓存的分片不再请求；配置快速模型时先批量调用快速模型，输出可疑的分片再批量交给主模型）
+        
+        Args:
+            chunk_lists: 每段文本的分片列表
+            
+        Returns:
+            每段文本重写后的分片列表（已去除空结果）
+        """
+        system_prompt = self._get_system_prompt()
+        results = [[None] * len(chunks) for chunks in chunk_lists]
+        
+        # 未命中缓存的分片：(文本索引, 分片序号, 提示词, 缓存键)
+        jobs = []
+        # 内容与讲话人都相同的分片只处理一次，结果复用到其余位置（包括其他文本中的相同分片）
+        first_seen = {}  # (分片内容, 讲话人) -> 首次出现的 (文本索引, 分片序号)
+        duplicates = []  # (文本索引, 分片序号, 首次出现的位置)
+        for text_idx, chunks in enumerate(chunk_lists):
+            for i, chunk in enumerate(chunks):
+                key = (chunk["text"], chunk.get("speaker"))
+                if key in first_seen:
+                    duplicates.append((text_idx, i, first_seen[key]))
+                    continue
+                first_seen[key] = (text_idx, i)
+                prompt = self._build_prompt(chunk["text"], chunk.get("speaker"), i, len(chunks))
+                cache_key = self._chunk_cache_key(system_prompt, prompt)
+                cached = self.cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    results[text_idx][i] = cached
+                else:
+                    jobs.append((text_idx, i, prompt, cache_key))
+        
+        if jobs:
+            try:
+                job_chunks = [chunk_lists[text_idx][i] for text_idx, i, _, _ in jobs]
+                prompts = [prompt for _, _, prompt, _ in jobs]
+                if self.fast_llm:
+                    outputs = self._generate_batch_cascade(job_chunks, prompts, system_prompt)
+                else:
+                    outputs = [
+                        self._postprocess_chunk(output, chunk.get("speaker"))
+                        for chunk, output in zip(job_chunks, self._generate_batch(prompts, system_prompt))
+                    ]
+                for (text_idx, i, _, cache_key), rewritten in zip(jobs, outputs):
+                    results[text_idx][i] = rewritten
+                    if cache_key:
+                        self.cache.set(cache_key, rewritten)
+            
+            except Exception as e:
+                # 批量调用失败时逐个分片回退（单个分片出错时返回原文）
+                error_msg = f"批量重写失败，回退为逐个分片处理: {str(e)}"
+                if self.logger:
+                    self.logger.warning(error_msg)
+                else:
+                    print(error_msg)
+                for text_idx, i, _, _ in jobs:
+                    chunks = chunk_lists[text_idx]
+                    results[text_idx][i] = self._rewrite_chunk(chunks[i], i, len(chunks))
+        
+        for text_idx, i, (source_text_idx, source_i) in duplicates:
+            results[text_idx][i] = results[source_text_idx][source_i]
+        
+        return [[r for r in text_results if r] for text_results in results]
+    
+    def _generate_batch(self, prompts: List[str], system_prompt: str, llm: Optional[BaseLLM] = None) -> List[str]:
+        """批量调用 LLM（默认为主模型）"""
+        return (llm or self.llm).generate_batch(
+            prompts,
+            system_prompt=system_prompt,
+            temperature=self.config.get("temperature", 0.3),
+            max_tokens=self.config.get("max_tokens", 4000),
+        )
+    
+    def _generate_batch_cascade(self, chunks: List[Dict], prompts: List[str], system_prompt: str) -> List[str]:
+        """先用快速模型批量重写，输出可疑的分片（快速模型调用出错时为全部分片）再统一交给主模型批量重写"""
+        try:
+            outputs = self._generate_batch(prompts, system_prompt, llm=self.fast_llm)
+            results = [self._postprocess_chunk(output, chunk.get("speaker")) for chunk, output in zip(chunks, outputs)]
+            escalate = [k for k, chunk in enumerate(chunks) if self._needs_escalation(chunk["text"], results[k])]
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"⚠️ 快速模型批量调用出错，全部分片改用主模型: {str(e)}")
+            results = [None] * len(prompts)
+            escalate = list(range(len(prompts)))
+        
+        if escalate:
+            if self.logger:
+                self.logger.info(f"⤴️ {len(escalate)}/{len(prompts)} 个分片改用主模型重写")
+            outputs = self._generate_batch([prompts[k] for k in escalate], system_prompt)
+            for k, output in zip(escalate, outputs):
+                results[k] = self._postprocess_chunk(output, chunks[k].get("speaker"))
+        return results
+    
+    def _postprocess_chunk(self, rewritten: str, speaker: Optional[str]) -> str:
+        """处理 LLM 输出：移除推理标记并保留讲话人标记"""
+        # 移除 LLM 推理标记
+        rewritten = self._remove_reasoning_markers(rewritten)
+        
+        # 保留讲话人标记
+        if speaker:
+            speaker_marker = f"【{speaker}】\n\n" if not rewritten.startswith("【") else ""
+            if speaker_marker and not rewritten.startswith(speaker_marker):
+                rewritten = speaker_marker + rewritten
+        
+        return rewritten.strip()
+    
     def _build_prompt(self, text: str, speaker: Optional[str], chunk_idx: int, total_chunks: int) -> str:
         """构建重写提示词"""
         context_info = ""
@@ -152,45 +487,15 @@ class TextRewriter:
         if speaker:
             speaker_info = f"\n\n讲话人：{speaker}"
         
-        if self.rewrite_prompt:
-            prompt = self.rewrite_prompt.format(
-                text=text,
-                speaker_info=speaker_info,
-                context_info=context_info
-            )
-        else:
-            prompt = f"""请将以下语音识别文本进行专业整理和重写，要求：
-
-1. **逐句纠错**：修正错别字、语法错误、识别错误
-2. **语义补全**：补全不完整的句子，确保语义完整
-3. **专业术语纠正**：纠正专业术语、人名、地名、机构名
-4. **去口语化**：将口语化表达转换为正式书面语
-5. **逻辑优化**：优化句子结构，使表达更清晰流畅
-6. **保持原意**：不改变原讲话人的核心内容和观点
-7. **保持结构**：保留段落结构和讲话人信息（如果有）{speaker_info}
-8. **完整输出**：**必须完整输出所有内容，不要遗漏任何句子或段落，不要截断内容**
-
-原始文本：
-{text}{context_info}
-
-**重要提示**：
-- 这是文本的一部分，请完整处理并输出所有内容
-- 如果这是多部分文本的一部分，请保持与前后文的连贯性
-- 必须输出完整的整理结果，不要因为长度限制而截断
-
-请输出整理后的文本（直接输出文本，不要添加额外说明）："""
-        
-        return prompt
+        return self._format_prompt(
+            text=text,
+            speaker_info=speaker_info,
+            context_info=context_info
+        )
     
     def _get_system_prompt(self) -> str:
         """获取系统提示词"""
-        return """你是一位专业的文本整理专家，擅长将语音识别文本转换为高质量、正式、结构清晰的书面文稿。
-你的任务是：
-- 准确理解原文内容
-- 修正所有错误和不规范之处
-- 保持原意不变
-- 输出正式、流畅的书面语
-- **必须完整输出所有内容，不要遗漏任何部分，不要截断内容**"""
+        return _SYSTEM_PROMPT
     
     def _merge_chunks(self, chunks: List[str]) -> str:
         """合并重写后的切片，智能去重重叠部分"""
@@ -200,7 +505,8 @@ class TextRewriter:
         if len(chunks) == 1:
             return chunks[0]
         
-        merged = []
+        # 各段依次写入同一缓冲区，段与段之间以空行分隔
+        merged = io.StringIO()
         prev_speaker = None
         prev_content = ""  # 用于检测重叠
         
@@ -223,14 +529,16 @@ class TextRewriter:
                         # 检查是否有重叠
                         deduped_content = self._deduplicate_overlap(prev_content, content)
                         if deduped_content:
-                            merged.append(deduped_content)
+                            merged.write(deduped_content)
+                            merged.write("\n\n")
                             prev_content = content
                 else:
                     # 新讲话人
                     if prev_speaker:
                         # 结束上一个讲话人的内容
-                        merged.append("")
-                    merged.append(chunk)
+                        merged.write("\n\n")
+                    merged.write(chunk)
+                    merged.write("\n\n")
                     prev_speaker = current_speaker
                     prev_content = content
             else:
@@ -239,17 +547,20 @@ class TextRewriter:
                     # 如果之前有讲话人，这是该讲话人的内容
                     deduped_content = self._deduplicate_overlap(prev_content, chunk)
                     if deduped_content:
-                        merged.append(deduped_content)
+                        merged.write(deduped_content)
+                        merged.write("\n\n")
                         prev_content = chunk
                 else:
                     # 没有讲话人的普通内容
                     deduped_content = self._deduplicate_overlap(prev_content, chunk)
                     if deduped_content:
-                        merged.append(deduped_content)
+                        merged.write(deduped_content)
+                        merged.write("\n\n")
                         prev_content = chunk
                     prev_speaker = None
         
-        return '\n\n'.join(merged)
+        result = merged.getvalue()
+        return result[:-2] if result.endswith("\n\n") else result
     
     def _deduplicate_overlap(self, prev_text: str, current_text: str) -> str:
         """去重重叠内容"""
@@ -257,37 +568,69 @@ class TextRewriter:
             return current_text
         
         # 检查当前文本开头是否与上一个文本结尾重叠
-        # 尝试找到重叠点（从后往前匹配）
-        overlap_threshold = 50  # 最小重叠字符数
-        
-        # 从上一个文本的末尾和当前文本的开头寻找重叠
-        prev_suffix = prev_text[-200:] if len(prev_text) > 200 else prev_text
-        current_prefix = current_text[:200] if len(current_text) > 200 else current_text
-        
-        # 寻找最长公共后缀-前缀
-        max_overlap = 0
-        for i in range(min(len(prev_suffix), len(current_prefix)), overlap_threshold - 1, -1):
-            if prev_suffix[-i:] == current_prefix[:i]:
-                max_overlap = i
-                break
+        # 较短的文本切片时直接返回原对象，不会额外复制
+        window = self._OVERLAP_WINDOW
+        max_overlap = self._longest_overlap(prev_text[-window:], current_text[:window], self._OVERLAP_MIN)
         
-        if max_overlap >= overlap_threshold:
+        if max_overlap:
             # 有重叠，去除重叠部分
             return current_text[max_overlap:].strip()
         
         return current_text
     
+    @staticmethod
+    def _longest_overlap(prev_text: str, current_text: str, min_overlap: int = 1) -> int:
+        """
+        计算 prev_text 的后缀与 current_text 的前缀的最长重叠长度
+        
+        用 str.find 定位 current_text 前 min_overlap 个字符在 prev_text 中的出现位置，
+        再用 startswith 校验该位置之后的后缀；查找与比较都在 C 层完成（memcmp），
+        不产生逐字符的 Python 循环。最靠前的命中位置即最长重叠。
+        
+        Args:
+            prev_text: 上一段文本（取其后缀）
+            current_text: 当前文本（取其前缀）
+            min_overlap: 最小重叠字符数，短于此长度的重叠视为没有
+            
+        Returns:
+            最长重叠的字符数，不足 min_overlap 时返回 0
+        """
+        if min_overlap < 1:
+            min_overlap = 1
+        if len(prev_text) < min_overlap or len(current_text) < min_overlap:
+            return 0
+        
+        probe = current_text[:min_overlap]
+        # 重叠长度不超过 current_text，起点之前的部分无需查找
+        pos = prev_text.find(probe, max(0, len(prev_text) - len(current_text)))
+        while pos != -1:
+            if current_text.startswith(prev_text[pos:]):
+                return len(prev_text) - pos
+            pos = prev_text.find(probe, pos + 1)
+        return 0
+    
+    def close(self):
+        """关闭本实例添加的日志处理器（释放日志文件句柄，不影响共用同一记录器的其他实例）"""
+        for handler in self._log_handlers:
+            self.logger.removeHandler(handler)
+            handler.close()
+        self._log_handlers = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
     def _init_logger(self, logging_config: Dict) -> Optional[logging.Logger]:
-        """初始化日志记录器"""
+        """初始化日志记录器（本实例添加的处理器记录在 _log_handlers 中，由 close 关闭）"""
+        self._log_handlers = []
         if not logging_config.get("enabled", False):
             return None
         
         logger = logging.getLogger("ScriptRefine.Rewriter")
         logger.setLevel(getattr(logging, logging_config.get("level", "DEBUG"), logging.DEBUG))
         
-        # 清除已有的处理器
-        logger.handlers.clear()
-        
         # 日志格式
         formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -299,20 +642,23 @@ class TextRewriter:
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(formatter)
             logger.addHandler(console_handler)
+            self._log_handlers.append(console_handler)
         
         # 文件输出
         if logging_config.get("output_to_file", True):
             log_dir = logging_config.get("log_dir", "./logs")
             os.makedirs(log_dir, exist_ok=True)
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = fast_timestamp()
             log_file_template = logging_config.get("log_file_template", "process_{timestamp}.log")
             log_filename = log_file_template.format(timestamp=timestamp)
             log_filepath = os.path.join(log_dir, log_filename)
             
-            file_handler = logging.FileHandler(log_filepath, encoding='utf-8')
+            # delay=True：首次写入日志时才打开文件
+            file_handler = logging.FileHandler(log_filepath, encoding='utf-8', delay=True)
             file_handler.setFormatter(formatter)
             logger.addHandler(file_handler)
+            self._log_handlers.append(file_handler)
             
             logger.info(f"📝 日志文件: {log_filepath}")
         
@@ -320,27 +666,7 @@ class TextRewriter:
     
     def _remove_reasoning_markers(self, text: str) -> str:
         """移除 LLM 推理过程标记"""
-        import re
-        # 移除各种推理标记（支持多行）
-        patterns = [
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<reasoning>.*?</reasoning>',  # <reasoning>...</reasoning>
-            r'<thought>.*?</thought>',  # <thought>...</thought>
-            r'<internal>.*?</internal>',  # <internal>...</internal>
-            r'<scratchpad>.*?</scratchpad>',  # <scratchpad>...</scratchpad>
-            r'<analysis>.*?</analysis>',  # <analysis>...</analysis>
-            r'<reflection>.*?</reflection>',  # <reflection>...</reflection>
-        ]
-        
-        for pattern in patterns:
-            # 使用 DOTALL 标志使 . 匹配换行符，IGNORECASE 忽略大小写
-            text = re.sub(pattern, '', text, flags=re.DOTALL | re.IGNORECASE)
-        
-        # 清理可能留下的多余空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        return text
+        return remove_reasoning_markers(text)
     
     def _load_prompt(self, prompt_path: str) -> Optional[str]:
         """加载提示词模板"""
@@ -351,16 +677,16 @@ class TextRewriter:
         if not os.path.isabs(prompt_path):
             prompt_path = os.path.join(os.path.dirname(__file__), "..", "..", prompt_path)
         
-        if os.path.exists(prompt_path):
-            try:
-                with open(prompt_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as e:
-                error_msg = f"加载提示词失败: {str(e)}"
-                if self.logger:
-                    self.logger.warning(error_msg)
-                else:
-                    print(error_msg)
+        try:
+            return read_prompt_file(os.path.normpath(prompt_path))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            error_msg = f"加载提示词失败: {str(e)}"
+            if getattr(self, "logger", None):
+                self.logger.warning(error_msg)
+            else:
+                print(error_msg)
         
         return None
 
@@ -2,17 +2,35 @@
 
 import os
 import logging
-from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from .llm import BaseLLM
+from .cache import ResultCache
+from .utils import fast_timestamp, remove_reasoning_markers, read_prompt_file
+
+
+# 日志分隔线
+_RULE = "=" * 80
+_THIN_RULE = "-" * 80
 
 
 class MeetingSummarizer:
     """会议纪要生成器"""
     
-    def __init__(self, llm: BaseLLM, config: Dict):
+    _CACHE_MAX_TEMPERATURE = 0.3  # 温度高于该值时输出随机性较大，不缓存纪要结果
+    
+    def __init__(self, llm: BaseLLM, config: Dict, cache: Optional[ResultCache] = None,
+                 cache_namespace: tuple = ()):
+        """
+        Args:
+            llm: LLM 实例
+            config: 纪要配置
+            cache: 纪要结果缓存（可选），相同提示词再次处理时直接返回缓存结果
+            cache_namespace: 缓存键前缀（如提供商与模型），区分不同模型的结果
+        """
         self.llm = llm
         self.config = config
+        self.cache = cache
+        self.cache_namespace = cache_namespace
         self.summary_prompt = self._load_prompt(config.get("prompts", {}).get("summary_prompt", ""))
         self.structure = config.get("output", {}).get("summary_version", {}).get("structure", [])
         self.logger = self._init_logger(config.get("logging", {}))
@@ -31,17 +49,27 @@ class MeetingSummarizer:
         prompt = self._build_prompt(text)
         system_prompt = self._get_system_prompt()
         
-        # 记录信息
-        if self.logger:
-            self.logger.info(f"\n{'='*80}")
-            self.logger.info(f"📋 生成会议纪要")
-            self.logger.info(f"{'='*80}")
-            self.logger.info(f"📝 输入文本长度: {len(text)} 字符")
-            self.logger.info(f"💬 提示词 ({len(prompt)} 字符):")
-            self.logger.info(f"{'-'*80}")
-            # 记录完整提示词（不截断）
-            self.logger.info(prompt)
-            self.logger.info(f"{'-'*80}")
+        # 记录信息（合并为一条日志；日志级别高于 INFO 时不拼接完整提示词）
+        if self.logger and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("\n".join([
+                f"\n{_RULE}",
+                "📋 生成会议纪要",
+                _RULE,
+                f"📝 输入文本长度: {len(text)} 字符",
+                f"💬 提示词 ({len(prompt)} 字符):",
+                _THIN_RULE,
+                prompt,  # 记录完整提示词（不截断）
+                _THIN_RULE,
+            ]))
+        
+        # 相同提示词已处理过时直接返回缓存结果
+        cache_key = self._summary_cache_key(system_prompt, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if self.logger:
+                    self.logger.info(f"♻️ 命中纪要缓存 ({len(cached)} 字符)")
+                return cached
         
         # 调用 LLM
         try:
@@ -60,13 +88,18 @@ class MeetingSummarizer:
             
             result = summary.strip()
             
-            if self.logger:
-                self.logger.info(f"✅ 会议纪要生成完成 ({len(result)} 字符)")
-                self.logger.info(f"📤 会议纪要内容:")
-                self.logger.info(f"{'-'*80}")
-                self.logger.info(result)
-                self.logger.info(f"{'-'*80}")
-                self.logger.info(f"{'='*80}\n")
+            if self.logger and self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("\n".join([
+                    f"✅ 会议纪要生成完成 ({len(result)} 字符)",
+                    "📤 会议纪要内容:",
+                    _THIN_RULE,
+                    result,
+                    _THIN_RULE,
+                    f"{_RULE}\n",
+                ]))
+            
+            if cache_key and result:
+                self.cache.set(cache_key, result)
             
             return result
         
@@ -79,6 +112,119 @@ class MeetingSummarizer:
                 print(error_msg)
             return ""
     
+    def summarize_stream(self, text: str):
+        """
+        流式生成会议纪要
+        
+        Args:
+            text: 完整文本
+            
+        Yields:
+            事件字典：
+            - {"type": "token", "content": 生成片段}
+            - {"type": "result", "content": 处理后的会议纪要}（最后一个事件）
+        """
+        pieces = []
+        try:
+            for piece in self.llm.generate_stream(
+                self._build_prompt(text),
+                system_prompt=self._get_system_prompt(),
+                temperature=self.config.get("temperature", 0.3),
+                max_tokens=self.config.get("max_tokens", 4000),
+            ):
+                pieces.append(piece)
+                yield {"type": "token", "content": piece}
+            result = self._remove_reasoning_markers("".join(pieces)).strip()
+        
+        except Exception as e:
+            error_msg = f"生成会议纪要时出错: {str(e)}"
+            if self.logger:
+                self.logger.error(error_msg)
+            else:
+                print(error_msg)
+            result = ""
+        
+        yield {"type": "result", "content": result}
+    
+    def summarize_batch(self, texts: List[str]) -> List[str]:
+        """
+        批量生成会议纪要，合并为一次 LLM 批量调用（已缓存或重复的文本不再请求）
+        
+        在线模型的 generate_batch 通过异步客户端并发发出请求，本地模型为一次批量推理。
+        
+        Args:
+            texts: 完整文本列表
+            
+        Returns:
+            会议纪要列表，顺序与 texts 一致
+        """
+        if not texts:
+            return []
+        
+        if self.logger:
+            self.logger.info(f"📋 批量生成会议纪要，共 {len(texts)} 段文本")
+        
+        system_prompt = self._get_system_prompt()
+        results = [None] * len(texts)
+        
+        # 未命中缓存的文本：(位置, 提示词, 缓存键)
+        jobs = []
+        # 相同的文本只处理一次，结果复用到其余位置
+        first_seen = {}  # 文本 -> 首次出现的位置
+        duplicates = []  # (位置, 首次出现的位置)
+        for i, text in enumerate(texts):
+            if text in first_seen:
+                duplicates.append((i, first_seen[text]))
+                continue
+            first_seen[text] = i
+            prompt = self._build_prompt(text)
+            cache_key = self._summary_cache_key(system_prompt, prompt)
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                jobs.append((i, prompt, cache_key))
+        
+        if jobs:
+            try:
+                summaries = self.llm.generate_batch(
+                    [prompt for _, prompt, _ in jobs],
+                    system_prompt=system_prompt,
+                    temperature=self.config.get("temperature", 0.3),
+                    max_tokens=self.config.get("max_tokens", 4000),
+                )
+                for (i, _, cache_key), summary in zip(jobs, summaries):
+                    results[i] = self._remove_reasoning_markers(summary).strip()
+                    if cache_key and results[i]:
+                        self.cache.set(cache_key, results[i])
+            
+            except Exception as e:
+                # 批量调用失败时逐个回退
+                error_msg = f"批量生成会议纪要失败，回退为逐个处理: {str(e)}"
+                if self.logger:
+                    self.logger.warning(error_msg)
+                else:
+                    print(error_msg)
+                for i, _, _ in jobs:
+                    results[i] = self.summarize(texts[i])
+        
+        for i, source in duplicates:
+            results[i] = results[source]
+        
+        return results
+    
+    def _summary_cache_key(self, system_prompt: str, prompt: str) -> Optional[str]:
+        """纪要结果的缓存键，未启用缓存或温度过高时返回 None"""
+        if self.cache is None or not self.cache.enabled:
+            return None
+        temperature = self.config.get("temperature", 0.3)
+        if temperature > self._CACHE_MAX_TEMPERATURE:
+            return None
+        return self.cache.make_key(
+            "summary", *self.cache_namespace,
+            system_prompt, prompt, temperature, self.config.get("max_tokens", 4000)
+        )
+    
     def _build_prompt(self, text: str) -> str:
         """构建摘要提示词"""
         structure_text = ""
@@ -117,17 +263,28 @@ class MeetingSummarizer:
 - 保持信息的准确性和完整性
 - 输出正式、专业的会议纪要"""
     
+    def close(self):
+        """关闭本实例添加的日志处理器（释放日志文件句柄，不影响共用同一记录器的其他实例）"""
+        for handler in self._log_handlers:
+            self.logger.removeHandler(handler)
+            handler.close()
+        self._log_handlers = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
     def _init_logger(self, logging_config: Dict) -> Optional[logging.Logger]:
-        """初始化日志记录器"""
+        """初始化日志记录器（本实例添加的处理器记录在 _log_handlers 中，由 close 关闭）"""
+        self._log_handlers = []
         if not logging_config.get("enabled", False):
             return None
         
         logger = logging.getLogger("ScriptRefine.Summarizer")
         logger.setLevel(getattr(logging, logging_config.get("level", "DEBUG"), logging.DEBUG))
         
-        # 清除已有的处理器
-        logger.handlers.clear()
-        
         # 日志格式
         formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -139,46 +296,29 @@ class MeetingSummarizer:
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(formatter)
             logger.addHandler(console_handler)
+            self._log_handlers.append(console_handler)
         
         # 文件输出
         if logging_config.get("output_to_file", True):
             log_dir = logging_config.get("log_dir", "./logs")
             os.makedirs(log_dir, exist_ok=True)
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = fast_timestamp()
             log_file_template = logging_config.get("log_file_template", "process_{timestamp}.log")
             log_filename = log_file_template.format(timestamp=timestamp)
             log_filepath = os.path.join(log_dir, log_filename)
             
-            file_handler = logging.FileHandler(log_filepath, encoding='utf-8')
+            # delay=True：首次写入日志时才打开文件
+            file_handler = logging.FileHandler(log_filepath, encoding='utf-8', delay=True)
             file_handler.setFormatter(formatter)
             logger.addHandler(file_handler)
+            self._log_handlers.append(file_handler)
         
         return logger
     
     def _remove_reasoning_markers(self, text: str) -> str:
         """移除 LLM 推理过程标记"""
-        import re
-        # 移除各种推理标记（支持多行）
-        patterns = [
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<reasoning>.*?</reasoning>',  # <reasoning>...</reasoning>
-            r'<thought>.*?</thought>',  # <thought>...</thought>
-            r'<internal>.*?</internal>',  # <internal>...</internal>
-            r'<scratchpad>.*?</scratchpad>',  # <scratchpad>...</scratchpad>
-            r'<analysis>.*?</analysis>',  # <analysis>...</analysis>
-            r'<reflection>.*?</reflection>',  # <reflection>...</reflection>
-        ]
-        
-        for pattern in patterns:
-            # 使用 DOTALL 标志使 . 匹配换行符，IGNORECASE 忽略大小写
-            text = re.sub(pattern, '', text, flags=re.DOTALL | re.IGNORECASE)
-        
-        # 清理可能留下的多余空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        return text
+        return remove_reasoning_markers(text)
     
     def _load_prompt(self, prompt_path: str) -> Optional[str]:
         """加载提示词模板"""
@@ -189,16 +329,16 @@ class MeetingSummarizer:
         if not os.path.isabs(prompt_path):
             prompt_path = os.path.join(os.path.dirname(__file__), "..", "..", prompt_path)
         
-        if os.path.exists(prompt_path):
-            try:
-                with open(prompt_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as e:
-                error_msg = f"加载提示词失败: {str(e)}"
-                if self.logger:
-                    self.logger.warning(error_msg)
-                else:
-                    print(error_msg)
+        try:
+            return read_prompt_file(os.path.normpath(prompt_path))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            error_msg = f"加载提示词失败: {str(e)}"
+            if getattr(self, "logger", None):
+                self.logger.warning(error_msg)
+            else:
+                print(error_msg)
         
         return None
 
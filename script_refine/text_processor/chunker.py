@@ -1,36 +1,91 @@
 """文本切片模块"""
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
+from itertools import accumulate
 import re
 from .speaker import SpeakerDetector
+from ..llm.base import count_cjk
 
-# 尝试导入 jieba 用于中文分词（可选）
+# 中文标点（CJK 符号与标点区段及常用全角标点），标点多为单个出现，逐个匹配后计数
+_CN_PUNCT_RE = re.compile(r'[\u3000-\u303f！？，；：]')
+# 句子：内容 + 句末标点（可连续），或没有句末标点的内容（以换行或文末结束）
+_SENTENCE_RE = re.compile(r'([^。！？.!?\n]*[。！？.!?]+)|([^。！？.!?\n]+)(\n)?')
+# 分句：内容 + 逗号、顿号、分号，或最后剩余的内容
+_CLAUSE_RE = re.compile(r'[^，、；]*[，、；]+|[^，、；]+')
+# 连续文本中的讲话人标记：【张三】或行首的"张三："
+_SPEAKER_SPLIT_PATTERNS = (
+    re.compile(r'【[^】]+】', re.MULTILINE),
+    re.compile(r'^[^：:]+[：:]', re.MULTILINE),
+)
+
+# 尝试导入 jieba 用于中文分词（可选），优先使用 C 扩展加速的 jieba_fast（接口兼容）
 try:
-    import jieba
+    import jieba_fast as jieba
     JIEBA_AVAILABLE = True
 except ImportError:
-    JIEBA_AVAILABLE = False
+    try:
+        import jieba
+        JIEBA_AVAILABLE = True
+    except ImportError:
+        JIEBA_AVAILABLE = False
+
+# jieba 词典是否已加载（进程内只加载一次，所有切片器共享）
+_JIEBA_READY = False
+
+
+def _ensure_jieba():
+    """首次需要分词时加载 jieba 词典"""
+    global _JIEBA_READY
+    if not _JIEBA_READY:
+        jieba.initialize()
+        _JIEBA_READY = True
+
+
+def _last_word(text: str) -> str:
+    """jieba 分词结果的最后一个词（逐个遍历分词生成器，不构造完整词表）"""
+    _ensure_jieba()
+    word = ""
+    for word in jieba.cut(text):
+        pass
+    return word
 
 
 class TextChunker:
     """文本切片器"""
     
-    def __init__(self, config: Dict, llm=None):
+    _CACHE_VERSION = 3  # 切片算法变化导致结果不同时递增，使旧的切片缓存失效
+    _TOKEN_CACHE_SIZE = 8192  # token 数缓存条数
+    _TOKEN_CACHE_MAX_CHARS = 2048  # 超过该长度的文本（如 fits 判断的整篇文档）不进入缓存，限制缓存占用的内存
+    
+    def __init__(self, config: Dict, llm=None, cache=None, cache_namespace: tuple = ()):
+        """
+        Args:
+            config: 切片配置
+            llm: LLM 实例（可选），用于计算 token
+            cache: 切片结果缓存（可选，ResultCache），同一文本再次切片时直接读取
+            cache_namespace: 缓存键前缀（如提供商与模型），不同分词器的 token 数不同
+        """
         self.config = config
+        self.cache = cache
+        self.cache_namespace = cache_namespace
         self.max_tokens = config.get("max_tokens", 3000)
         self.overlap = config.get("overlap", 500)  # 增加默认重叠
         self.min_chunk_size = config.get("min_chunk_size", 100)
         self.preserve_speakers = config.get("preserve_speakers", True)
         self.use_chinese_segmentation = config.get("use_chinese_segmentation", True)  # 是否使用中文分词
         self.llm = llm  # 用于计算 token
+        # 同一段落/句子在切片、拆分大段落和构造重叠时会被反复计数，按内容缓存结果
+        # （唯一的 token 数缓存，LLM 的 count_tokens 本身不再缓存）
+        self._cached_count_tokens = lru_cache(maxsize=self._TOKEN_CACHE_SIZE)(self._count_tokens_uncached)
         # 从 text_processing.speaker_detection 获取配置
         speaker_config = config.get("speaker_detection", {})
         self.speaker_detector = SpeakerDetector(speaker_config) if self.preserve_speakers else None
-        
-        # 初始化 jieba（如果可用）
+    
+    def warmup(self):
+        """提前加载 jieba 词典（默认在首次分词时才加载），如 preload 时在 fork 前完成"""
         if JIEBA_AVAILABLE and self.use_chinese_segmentation:
-            # 加载用户词典（如果有）
-            jieba.initialize()
+            _ensure_jieba()
     
     def chunk(self, text: str) -> List[Dict[str, any]]:
         """
@@ -50,15 +105,23 @@ class TextChunker:
             return []
         
         # 如果文本很短，直接返回
-        token_count = self._count_tokens(text)
-        if token_count <= self.max_tokens:
-            return [{
-                "text": text,
-                "start_idx": 0,
-                "end_idx": len(text),
-                "speaker": self._detect_speaker(text) if self.speaker_detector else None,
-            }]
-        
+        if self.fits(text):
+            return [self.whole_chunk(text)]
+        
+        # 同一文本在相同配置下切过时直接读取缓存的切片结果
+        cache_key = self._chunks_cache_key(text)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        chunks = self._chunk_paragraphs(text)
+        if cache_key:
+            self.cache.set(cache_key, chunks)
+        return chunks
+    
+    def _chunk_paragraphs(self, text: str) -> List[Dict[str, any]]:
+        """按段落构建切片并添加重叠（chunk 的主体，不经过缓存）"""
         # 按段落分割
         paragraphs = self._split_into_paragraphs(text)
         
@@ -80,7 +143,7 @@ class TextChunker:
                     current_tokens = 0
                 
                 # 分割大段落
-                sub_chunks = self._split_large_paragraph(para["text"], para["start_idx"])
+                sub_chunks = self._split_large_paragraph(para["text"], para["start_idx"], para_speaker)
                 chunks.extend(sub_chunks)
                 continue
             
@@ -107,24 +170,59 @@ class TextChunker:
         
         return chunks
     
+    def _chunks_cache_key(self, text: str) -> Optional[str]:
+        """切片结果的缓存键（文本 + 影响切片结果的配置），未启用缓存时返回 None"""
+        if self.cache is None or not self.cache.enabled:
+            return None
+        # 讲话人识别的开关与模式都会改变段落划分和切片的 speaker 字段
+        speaker_options = None
+        if self.speaker_detector:
+            speaker_options = (self.speaker_detector.enabled, self.speaker_detector.patterns)
+        return self.cache.make_key(
+            "chunks", self._CACHE_VERSION, *self.cache_namespace,
+            self.max_tokens, self.overlap, self.min_chunk_size,
+            self.use_chinese_segmentation and JIEBA_AVAILABLE, speaker_options, text
+        )
+    
+    def fits(self, text: str) -> bool:
+        """
+        判断文本是否无需切分（token 数不超过单个切片上限）
+        
+        Args:
+            text: 输入文本
+            
+        Returns:
+            能放入单个切片时返回 True
+        """
+        return bool(text) and self._count_tokens(text) <= self.max_tokens
+    
+    def whole_chunk(self, text: str) -> Dict[str, any]:
+        """将整段文本作为单个切片返回（不做段落分割与重叠处理）"""
+        return {
+            "text": text,
+            "start_idx": 0,
+            "end_idx": len(text),
+            "speaker": self._detect_speaker(text) if self.speaker_detector else None,
+        }
+    
     def _split_into_paragraphs(self, text: str) -> List[Dict]:
         """将文本分割为段落，处理没有良好分段的文本"""
         paragraphs = []
         lines = text.split('\n')
         
         current_para = []
-        current_start = 0
         para_start_idx = 0
+        line_start = 0  # 当前行在原文中的起始位置（逐行累加行长与换行符）
+        # 讲话人标记行的行首位置（对整段文本一次扫描得到，不再逐行调用 detect）
+        marker_starts = self.speaker_detector.marker_line_starts(text) if self.speaker_detector else set()
         
-        for i, line in enumerate(lines):
+        for line in lines:
+            line_idx = line_start
+            line_start += len(line) + 1
             line_stripped = line.strip()
             
             # 检测讲话人标记（作为段落边界）
-            is_speaker_marker = False
-            if self.speaker_detector and line_stripped:
-                detected_speaker = self.speaker_detector.detect(line_stripped)
-                if detected_speaker:
-                    is_speaker_marker = True
+            is_speaker_marker = bool(line_stripped) and line_idx in marker_starts
             
             # 空行或讲话人标记作为段落边界
             if not line_stripped or is_speaker_marker:
@@ -140,13 +238,13 @@ class TextChunker:
                 
                 # 如果是讲话人标记，开始新段落
                 if is_speaker_marker:
-                    para_start_idx = text.find(line, para_start_idx if paragraphs else 0)
+                    para_start_idx = line_idx
                     current_para = [line]
                 continue
             
             # 如果当前段落为空，记录起始位置
             if not current_para:
-                para_start_idx = text.find(line, para_start_idx if paragraphs else 0)
+                para_start_idx = line_idx
             
             current_para.append(line)
         
@@ -169,20 +267,13 @@ class TextChunker:
     def _split_continuous_text(self, text: str) -> List[Dict]:
         """分割没有明确段落边界的连续文本"""
         paragraphs = []
-        import re
         
         # 方法1: 按讲话人标记分割
-        speaker_patterns = [
-            r'【[^】]+】',
-            r'^[^：:]+[：:]',
-        ]
-        
-        # 尝试按讲话人标记分割
         splits = []
         last_pos = 0
         
-        for pattern in speaker_patterns:
-            for match in re.finditer(pattern, text, re.MULTILINE):
+        for pattern in _SPEAKER_SPLIT_PATTERNS:
+            for match in pattern.finditer(text):
                 if match.start() > last_pos:
                     splits.append(match.start())
                 last_pos = match.end()
@@ -212,6 +303,7 @@ class TextChunker:
         # 按句子组合成段落，每个段落不超过一定长度
         current_para = []
         current_tokens = 0
+        current_len = 0  # 当前段落已累计的字符数，保存段落时直接用于推进 para_start
         para_start = 0
         max_para_tokens = self.max_tokens // 2  # 段落最大 token 数
         
@@ -226,26 +318,28 @@ class TextChunker:
                     paragraphs.append({
                         "text": para_text,
                         "start_idx": para_start,
-                        "end_idx": para_start + len(para_text),
+                        "end_idx": para_start + current_len,
                         "speaker": self._detect_speaker(para_text) if self.speaker_detector else None,
                     })
-                    para_start += len(para_text)
+                    para_start += current_len
                     current_para = []
                     current_tokens = 0
+                    current_len = 0
                 
                 # 长句子单独成段
-                para_text = sent
+                sent_len = len(sent)
                 paragraphs.append({
-                    "text": para_text,
+                    "text": sent,
                     "start_idx": para_start,
-                    "end_idx": para_start + len(para_text),
-                    "speaker": self._detect_speaker(para_text) if self.speaker_detector else None,
+                    "end_idx": para_start + sent_len,
+                    "speaker": self._detect_speaker(sent) if self.speaker_detector else None,
                 })
-                para_start += len(para_text)
+                para_start += sent_len
             elif current_tokens + sent_tokens <= max_para_tokens:
                 # 可以添加到当前段落
                 current_para.append(sent)
                 current_tokens += sent_tokens
+                current_len += len(sent)
             else:
                 # 保存当前段落，开始新段落
                 if current_para:
@@ -253,13 +347,14 @@ class TextChunker:
                     paragraphs.append({
                         "text": para_text,
                         "start_idx": para_start,
-                        "end_idx": para_start + len(para_text),
+                        "end_idx": para_start + current_len,
                         "speaker": self._detect_speaker(para_text) if self.speaker_detector else None,
                     })
-                    para_start += len(para_text)
+                    para_start += current_len
                 
                 current_para = [sent]
                 current_tokens = sent_tokens
+                current_len = len(sent)
         
         # 最后一个段落
         if current_para:
@@ -267,7 +362,7 @@ class TextChunker:
             paragraphs.append({
                 "text": para_text,
                 "start_idx": para_start,
-                "end_idx": para_start + len(para_text),
+                "end_idx": para_start + current_len,
                 "speaker": self._detect_speaker(para_text) if self.speaker_detector else None,
             })
         
@@ -281,8 +376,10 @@ class TextChunker:
     def _split_by_length(self, text: str) -> List[Dict]:
         """按固定长度分割文本（最后手段），尽量在语义边界处断开"""
         paragraphs = []
+        # 纯 ASCII 文本（英文语稿）跳过中文字符统计与 jieba 分词
+        is_ascii = text.isascii()
         # 根据 token 限制估算字符数（中文更紧凑）
-        chinese_ratio = sum(1 for c in text if '\u4e00' <= c <= '\u9fff') / max(len(text), 1)
+        chinese_ratio = 0 if is_ascii else count_cjk(text) / max(len(text), 1)
         if chinese_ratio > 0.5:  # 主要是中文
             chunk_size = int(self.max_tokens * 1.3)  # 中文更紧凑
         else:
@@ -307,11 +404,17 @@ class TextChunker:
                 
                 # 如果使用了 jieba，尝试在词边界处断开
                 if JIEBA_AVAILABLE and self.use_chinese_segmentation:
-                    chunk = text[start:end]
-                    words = list(jieba.cut(chunk))
-                    if words and len(words[-1]) < 5:  # 最后一个词很短，可能不完整
+                    if is_ascii:
+                        # 纯 ASCII 文本无需分词：末尾连续的字母数字即最后一个词（与 jieba 的切分一致）
+                        word_start = end
+                        while word_start > max(start, end - 5) and text[word_start - 1].isalnum():
+                            word_start -= 1
+                        last_word_len = (end - word_start) or 1
+                    else:
+                        last_word_len = len(_last_word(text[start:end]))
+                    if 0 < last_word_len < 5:  # 最后一个词很短，可能不完整
                         # 向前调整到词边界
-                        word_end = len(chunk) - len(words[-1])
+                        word_end = end - start - last_word_len
                         if word_end > chunk_size * 0.8:  # 至少保留 80% 的内容
                             end = start + word_end
             
@@ -332,13 +435,28 @@ class TextChunker:
             "speaker": self._detect_speaker(text) if self.speaker_detector else None,
         }]
     
-    def _split_large_paragraph(self, text: str, start_idx: int) -> List[Dict]:
-        """分割过大的段落"""
+    def _split_large_paragraph(self, text: str, start_idx: int,
+                               parent_speaker: Optional[str] = None) -> List[Dict]:
+        """
+        分割过大的段落
+        
+        Args:
+            text: 段落文本
+            start_idx: 段落在原文中的起始位置
+            parent_speaker: 段落的讲话人（已检测过），各子切片沿用，
+                只有以新的讲话人标记开头的子切片才重新检测
+        """
+        def detect(chunk_text: str) -> Optional[str]:
+            if parent_speaker is not None and not chunk_text.startswith('【'):
+                return parent_speaker
+            return self._detect_speaker(chunk_text) if self.speaker_detector else None
+        
         chunks = []
         sentences = self._split_into_sentences(text)
         
         current_chunk = []
         current_tokens = 0
+        current_len = 0  # 当前切片已累计的字符数
         
         for sent in sentences:
             sent_tokens = self._count_tokens(sent)
@@ -346,63 +464,48 @@ class TextChunker:
             if current_tokens + sent_tokens <= self.max_tokens:
                 current_chunk.append(sent)
                 current_tokens += sent_tokens
+                current_len += len(sent)
             else:
                 if current_chunk:
                     chunk_text = ''.join(current_chunk)
                     chunks.append({
                         "text": chunk_text,
                         "start_idx": start_idx,
-                        "end_idx": start_idx + len(chunk_text),
-                        "speaker": self._detect_speaker(chunk_text) if self.speaker_detector else None,
+                        "end_idx": start_idx + current_len,
+                        "speaker": detect(chunk_text),
                     })
-                    start_idx += len(chunk_text)
+                    start_idx += current_len
                 
                 current_chunk = [sent]
                 current_tokens = sent_tokens
+                current_len = len(sent)
         
         if current_chunk:
             chunk_text = ''.join(current_chunk)
             chunks.append({
                 "text": chunk_text,
                 "start_idx": start_idx,
-                "end_idx": start_idx + len(chunk_text),
-                "speaker": self._detect_speaker(chunk_text) if self.speaker_detector else None,
+                "end_idx": start_idx + current_len,
+                "speaker": detect(chunk_text),
             })
         
         return chunks
     
     def _split_into_sentences(self, text: str) -> List[str]:
         """将文本分割为句子，支持中文标点符号和边界"""
-        # 中文标点符号：。！？，、；：；等
-        # 先处理换行（可能是句子边界）
-        text_normalized = re.sub(r'\n+', '。', text)
-        
-        # 按中文句号、问号、感叹号分割（全角和半角都支持）
-        # 匹配：。！？.!?
-        sentences = re.split(r'([。！？\.!?])', text_normalized)
+        # 按中文句号、问号、感叹号分割（全角和半角都支持），换行也视为句子边界：
+        # 一次 finditer 直接得到各句，不再先替换换行、再 split 后两两拼接
         result = []
-        for i in range(0, len(sentences) - 1, 2):
-            if i + 1 < len(sentences):
-                sent = sentences[i] + sentences[i + 1]
-                sent = sent.strip()
-                if sent:
-                    result.append(sent)
-        if len(sentences) % 2 == 1 and sentences[-1].strip():
-            result.append(sentences[-1].strip())
+        for match in _SENTENCE_RE.finditer(text):
+            sent = match.group(1) or match.group(2)
+            sent = sent.strip()
+            if sent:
+                # 以换行结尾、没有句末标点的句子补上句号（与按句号分句的结果保持一致）
+                result.append(sent + '。' if match.group(3) else sent)
         
         # 如果分割结果为空或太少，尝试更宽松的分割（按中文逗号、分号）
         if len(result) < 2:
-            # 中文逗号、分号：，、；
-            sentences = re.split(r'([，、；])', text)
-            result = []
-            for i in range(0, len(sentences) - 1, 2):
-                if i + 1 < len(sentences):
-                    sent = sentences[i] + sentences[i + 1]
-                    sent = sent.strip()
-                    if sent:
-                        result.append(sent)
-            if len(sentences) % 2 == 1 and sentences[-1].strip():
-                result.append(sentences[-1].strip())
+            result = [sent for sent in map(str.strip, _CLAUSE_RE.findall(text)) if sent]
         
         # 如果还是没有结果，尝试按长度和语义分割（避免在词中间断开）
         if len(result) < 2 and len(text) > 100:
@@ -420,6 +523,9 @@ class TextChunker:
         # 使用 jieba 分词，在词边界处分割
         # 将文本分成较小的块，每个块在词边界处结束
         chunk_size = 200  # 字符数
+        if text.isascii():
+            # 纯 ASCII 文本没有下方查找的中文标点，断点不会调整：无需分词，直接按固定长度切分（原样保留空格）
+            return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
         chunks = []
         start = 0
         
@@ -430,9 +536,9 @@ class TextChunker:
             # 如果还没到文本末尾，尝试在词边界处调整
             if end < len(text):
                 # 使用 jieba 分词找到最近的词边界
-                words = list(jieba.cut(chunk))
+                last_word = _last_word(chunk)
                 # 如果最后一个词很短，可能是不完整的，向前调整
-                if words and len(words[-1]) < 3:
+                if last_word and len(last_word) < 3:
                     # 尝试找到最近的标点符号
                     for i in range(len(chunk) - 1, max(len(chunk) - 50, 0), -1):
                         if chunk[i] in '。！？，、；':
@@ -491,34 +597,21 @@ class TextChunker:
         if len(chunks) <= 1:
             return chunks
         
+        # 重叠内容取自各块原文的开头，每块只计算一次（中间块的前后重叠都由此查表得到）
+        heads = [self._get_overlap_text(None, chunk["text"], self.overlap) for chunk in chunks]
+        
         overlapped = []
+        last = len(chunks) - 1
         for i, chunk in enumerate(chunks):
             if i == 0:
                 # 第一个块：添加下一个块的开头
-                if i + 1 < len(chunks):
-                    next_chunk = chunks[i + 1]
-                    overlap_text = self._get_overlap_text(
-                        chunk["text"], next_chunk["text"], self.overlap
-                    )
-                    chunk["text"] = chunk["text"] + "\n\n" + overlap_text
-            elif i == len(chunks) - 1:
+                chunk["text"] = chunk["text"] + "\n\n" + heads[i + 1]
+            elif i == last:
                 # 最后一个块：添加前一个块的结尾
-                prev_chunk = chunks[i - 1]
-                overlap_text = self._get_overlap_text(
-                    prev_chunk["text"], chunk["text"], self.overlap
-                )
-                chunk["text"] = overlap_text + "\n\n" + chunk["text"]
+                chunk["text"] = heads[i] + "\n\n" + chunk["text"]
             else:
                 # 中间块：添加前后重叠
-                prev_chunk = chunks[i - 1]
-                next_chunk = chunks[i + 1]
-                prev_overlap = self._get_overlap_text(
-                    prev_chunk["text"], chunk["text"], self.overlap
-                )
-                next_overlap = self._get_overlap_text(
-                    chunk["text"], next_chunk["text"], self.overlap
-                )
-                chunk["text"] = prev_overlap + "\n\n" + chunk["text"] + "\n\n" + next_overlap
+                chunk["text"] = heads[i] + "\n\n" + chunk["text"] + "\n\n" + heads[i + 1]
             
             overlapped.append(chunk)
         
@@ -528,18 +621,15 @@ class TextChunker:
         """获取重叠文本"""
         # 简单实现：从 text2 开头取一定 token 的内容
         sentences = self._split_into_sentences(text2)
-        overlap_text = ""
-        tokens = 0
         
-        for sent in sentences:
-            sent_tokens = self._count_tokens(sent)
-            if tokens + sent_tokens <= overlap_tokens:
-                overlap_text += sent
-                tokens += sent_tokens
-            else:
+        # 按累计 token 数（前缀和）确定能放下的句子数，超出后即停止计数，最后一次拼接
+        count = 0
+        for total in accumulate(map(self._count_tokens, sentences)):
+            if total > overlap_tokens:
                 break
+            count += 1
         
-        return overlap_text
+        return ''.join(sentences[:count])
     
     def _detect_speaker(self, text: str) -> str:
         """检测讲话人"""
@@ -548,14 +638,23 @@ class TextChunker:
         return None
     
     def _count_tokens(self, text: str) -> int:
+        """计算 token 数量（短文本带缓存）"""
+        if len(text) > self._TOKEN_CACHE_MAX_CHARS:
+            return self._count_tokens_uncached(text)
+        return self._cached_count_tokens(text)
+    
+    def _count_tokens_uncached(self, text: str) -> int:
         """计算 token 数量，对中文进行优化"""
         if self.llm:
             return self.llm.count_tokens(text)
+        elif text.isascii():
+            # 纯 ASCII 文本没有中文字符与中文标点，估算结果只取决于长度
+            return max(int(len(text) / 3.5), 1)
         else:
             # 更准确的中文 token 估算
-            # 统计中文字符、中文标点、英文、数字等
-            chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-            chinese_punctuation = sum(1 for c in text if '\u3000' <= c <= '\u303f' or c in '。！？，、；：')
+            # 统计中文字符、中文标点、英文、数字等（计数在 C 层完成，不逐字符循环）
+            chinese_chars = count_cjk(text)
+            chinese_punctuation = len(_CN_PUNCT_RE.findall(text))
             other_chars = len(text) - chinese_chars - chinese_punctuation
             
             # 不同模型的 token 化不同，这里使用更保守的估算
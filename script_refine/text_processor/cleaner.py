@@ -1,18 +1,147 @@
 """文本清洗模块"""
 
+import os
 import re
-from typing import List, Dict
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+
+from ..utils import remove_reasoning_markers
+
+logger = logging.getLogger("ScriptRefine.Cleaner")
+
+# 优先使用 pyahocorasick（Aho-Corasick 自动机的 C 扩展）做多模式定长串匹配，未安装时回退为逐个查找 / 正则
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Google RE2（可选，需在配置中开启 use_re2）：基于自动机、匹配时间与文本长度成线性关系，不会回溯
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+# 常见乱码字符及其替换
+_ENCODING_REPLACEMENTS = {
+    "锘?": "",
+    "鈥?": "",
+}
+
+# ASR 重复标点：各分支依次为 [。，、]{3,}、！{2,}、？{2,}、，{2,}，替换为对应分支的标点
+_REPEATED_PUNCT_RE = re.compile(r'([。，、]{3,})|(！{2,})|(？{2,})|(，{2,})')
+_REPEATED_PUNCT_REPL = ('。', '！', '？', '，')
+# ASR 时间戳标记（如 [00:01:23]、(00:01:23)）与识别置信度标记（如 (0.95)）：(必须出现的子串, 正则)
+_ASR_MARK_PATTERNS = (
+    ('[', re.compile(r'\[\d{2}:\d{2}:\d{2}\]')),
+    ('(', re.compile(r'\(\d{2}:\d{2}:\d{2}\)')),
+    ('(0.', re.compile(r'\(0\.\d+\)')),
+)
+# 连续重复 3 次及以上的词（如"很好很好很好"）
+_REPEATED_PHRASE_RE = re.compile(r'(.{2,10})\1{2,}')
+# 句子及其结束符（紧随其后的句末标点与换行，保留分段；文本末尾没有结束符的句子，结束符为空）
+_SENTENCE_RE = re.compile(r'([^。！？\n]+)([。！？]*\n*)')
+# 以逗号结尾（忽略行尾空白）且后面还有下一行的位置，即可能需要合并断句的位置
+_COMMA_LINE_END_RE = re.compile(r'，[^\S\n]*\n')
+# 没有句末标点的行尾
+_MISSING_END_PUNCT_RE = re.compile(r'([^。！？\n])(\n|$)')
+# 连续两个及以上空格（单个空格无需替换，不匹配）、连续三个及以上换行
+_MULTI_SPACE_RE = re.compile(r' {2,}')
+_MULTI_BLANK_RE = re.compile(r'\n{3,}')
+# 制表符、垂直制表符、换页符统一转为空格，再与普通空格一起合并
+_SPACE_LIKE_CHARS = '\t\v\f'
+_SPACE_LIKE_TRANS = str.maketrans(_SPACE_LIKE_CHARS, ' ' * len(_SPACE_LIKE_CHARS))
+
+
+def _build_automaton(replacements: Dict[str, str]):
+    """
+    构建 Aho-Corasick 自动机（未安装 pyahocorasick 时返回 None）
+    
+    Args:
+        replacements: 待匹配串 -> 替换串
+        
+    Returns:
+        自动机，每个匹配的值为 (待匹配串, 替换串)
+    """
+    if ahocorasick is None or not replacements:
+        return None
+    automaton = ahocorasick.Automaton()
+    for old, new in replacements.items():
+        automaton.add_word(old, (old, new))
+    automaton.make_automaton()
+    return automaton
+
+
+def _replace_with_automaton(automaton, text: str) -> str:
+    """一次扫描替换所有匹配（最长优先、互不重叠），只在最后拼接一次"""
+    pieces = []
+    last = 0
+    for end, (old, new) in automaton.iter_long(text):
+        start = end - len(old) + 1
+        pieces.append(text[last:start])
+        pieces.append(new)
+        last = end + 1
+    if not pieces:
+        return text
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+
+_ENCODING_AUTOMATON = _build_automaton(_ENCODING_REPLACEMENTS)
+
+
+def _to_re2(pattern: re.Pattern):
+    """
+    将已编译的标准库正则改用 RE2 编译（标志位转为内联写法）；未安装 re2 或语法不受支持（如反向引用）时原样返回
+    
+    Args:
+        pattern: 标准库正则
+        
+    Returns:
+        RE2 正则或原正则（两者的 sub 接口一致）
+    """
+    if re2 is None:
+        return pattern
+    inline_flags = "".join(
+        flag for flag, bit in (("m", re.MULTILINE), ("s", re.DOTALL), ("i", re.IGNORECASE))
+        if pattern.flags & bit
+    )
+    try:
+        return re2.compile(f"(?{inline_flags}){pattern.pattern}" if inline_flags else pattern.pattern)
+    except re2.error:
+        return pattern
+
+
+# 并行清洗时每个工作进程内的清洗器（由进程池初始化函数创建一次，正则只在每个进程中编译一次）
+_worker_cleaner = None
+
+
+def _init_clean_worker(config: Dict):
+    """进程池初始化：在工作进程中按配置创建清洗器"""
+    global _worker_cleaner
+    _worker_cleaner = TextCleaner(config)
+
+
+def _clean_in_worker(text: str) -> str:
+    """在工作进程中清洗单段文本"""
+    return _worker_cleaner.clean(text)
 
 
 class TextCleaner:
     """文本清洗器"""
     
+    _PARALLEL_MIN_TEXTS = 256  # 待清洗的文本少于该数量时不启动进程池（进程启动开销大于收益，远大于 Web 端单批请求数）
+    
     def __init__(self, config: Dict):
         self.config = config
         self.remove_filler_words = config.get("remove_filler_words", True)
         self.merge_broken_sentences = config.get("merge_broken_sentences", True)
         self.remove_duplicates = config.get("remove_duplicates", True)
         self.fix_encoding = config.get("fix_encoding", True)
+        # 使用 RE2 执行时间戳与语气词正则（需安装 google-re2；RE2 的 \d、\s 只匹配 ASCII 字符）
+        self.use_re2 = config.get("use_re2", False) and re2 is not None
         self.remove_llm_reasoning = config.get("remove_llm_reasoning", True)
         
         # 常见语气词和口头禅
@@ -22,6 +151,19 @@ class TextCleaner:
             "其实", "基本上", "大概", "可能", "应该", "好像",
             "怎么说呢", "怎么说", "就是那个", "这个那个"
         ]
+        # 所有语气词合并为一个分支正则（长词在前，避免"怎么说呢"只匹配到"怎么说"），
+        # 开头、结尾、中间各扫描一次；连续出现的多个语气词在同一次匹配中一起去除
+        filler_alt = "|".join(map(re.escape, sorted(self.filler_words, key=len, reverse=True)))
+        self._filler_start_re = re.compile(rf'^(?:(?:{filler_alt})[，。、\s]*)+', re.MULTILINE)
+        self._filler_end_re = re.compile(rf'(?:[，。、\s]*(?:{filler_alt}))+$', re.MULTILINE)
+        self._filler_mid_re = re.compile(rf'[，。、\s]+(?:(?:{filler_alt})[，。、\s]+)+')
+        self._asr_mark_patterns = _ASR_MARK_PATTERNS
+        if self.use_re2:
+            self._asr_mark_patterns = tuple((probe, _to_re2(pattern)) for probe, pattern in _ASR_MARK_PATTERNS)
+            self._filler_start_re = _to_re2(self._filler_start_re)
+            self._filler_end_re = _to_re2(self._filler_end_re)
+            self._filler_mid_re = _to_re2(self._filler_mid_re)
+        self._filler_automaton = _build_automaton({word: word for word in self.filler_words})
     
     def clean(self, text: str) -> str:
         """
@@ -40,7 +182,7 @@ class TextCleaner:
         if self.fix_encoding:
             text = self._fix_encoding(text)
         
-        # 移除 LLM 推理标记（如 <think>...</think>, <think>...</think>）
+        # 移除 LLM 推理标记（如 <think>...</think>, <reasoning>...</reasoning>）
         if self.remove_llm_reasoning:
             text = self._remove_llm_reasoning_markers(text)
         
@@ -67,57 +209,69 @@ class TextCleaner:
         
         return text.strip()
     
+    def clean_batch(self, texts: List[str], workers: Optional[int] = 1) -> List[str]:
+        """
+        批量清洗文本（相同的文本只清洗一次）
+        
+        默认在当前进程中逐个清洗；多进程并行需显式传入 workers，仅用于命令行 / 离线大批量处理，
+        不要在 Web 服务进程中开启（多线程进程中创建子进程有死锁风险，且每批都要承担进程启动开销）。
+        
+        Args:
+            texts: 原始文本列表
+            workers: 并行进程数，1 表示在当前进程中逐个清洗（默认），None 表示使用 CPU 核数
+            
+        Returns:
+            清洗后的文本列表，顺序与 texts 一致
+        """
+        pending = list(dict.fromkeys(texts))  # 去重后的待清洗文本（保持首次出现的顺序）
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        
+        cleaned = None
+        if workers > 1 and len(pending) >= self._PARALLEL_MIN_TEXTS:
+            try:
+                # 使用 spawn 启动全新的子进程，不继承父进程的线程、锁与已加载的模型
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_clean_worker,
+                    initargs=(self.config,),
+                ) as executor:
+                    # 每个任务包含多段文本，减少进程间通信次数
+                    chunksize = max(1, len(pending) // (workers * 4))
+                    cleaned = dict(zip(pending, executor.map(_clean_in_worker, pending, chunksize=chunksize)))
+            except Exception as e:
+                # 无法创建进程池（如受限环境）时回退为逐个清洗
+                logger.warning(f"⚠️ 并行清洗失败，改为逐个处理: {str(e)}")
+        
+        if cleaned is None:
+            cleaned = {text: self.clean(text) for text in pending}
+        return [cleaned[text] for text in texts]
+    
     def _fix_encoding(self, text: str) -> str:
         """修复常见编码问题"""
-        # 替换常见乱码字符
-        replacements = {
-            "锘?": "",
-            "鈥?": "",
-            "鈥?": "",
-            "鈥?": "",
-            "鈥?": "",
-        }
-        for old, new in replacements.items():
-            text = text.replace(old, new)
+        # 替换常见乱码字符（有自动机时一次扫描完成全部替换）
+        if _ENCODING_AUTOMATON is not None:
+            return _replace_with_automaton(_ENCODING_AUTOMATON, text)
+        for old, new in _ENCODING_REPLACEMENTS.items():
+            if old in text:
+                text = text.replace(old, new)
         return text
     
     def _remove_llm_reasoning_markers(self, text: str) -> str:
         """移除 LLM 推理过程标记"""
-        # 移除各种推理标记（支持多行）
-        patterns = [
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<think>.*?</think>',  # <think>...</think>
-            r'<reasoning>.*?</reasoning>',  # <reasoning>...</reasoning>
-            r'<thought>.*?</thought>',  # <thought>...</thought>
-            r'<internal>.*?</internal>',  # <internal>...</internal>
-            r'<scratchpad>.*?</scratchpad>',  # <scratchpad>...</scratchpad>
-            r'<analysis>.*?</analysis>',  # <analysis>...</analysis>
-            r'<reflection>.*?</reflection>',  # <reflection>...</reflection>
-        ]
-        
-        for pattern in patterns:
-            # 使用 DOTALL 标志使 . 匹配换行符，IGNORECASE 忽略大小写
-            text = re.sub(pattern, '', text, flags=re.DOTALL | re.IGNORECASE)
-        
-        # 清理可能留下的多余空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        return text
+        # 与重写器、纪要生成器共用同一个合并后的正则，一次扫描移除所有推理标记并清理多余空行
+        return remove_reasoning_markers(text)
     
     def _remove_asr_artifacts(self, text: str) -> str:
         """移除 ASR 识别产生的冗余符号"""
         # 移除重复的标点
-        text = re.sub(r'[。，、]{3,}', '。', text)
-        text = re.sub(r'[！]{2,}', '！', text)
-        text = re.sub(r'[？]{2,}', '？', text)
-        text = re.sub(r'[，]{2,}', '，', text)
+        # （四条规则合并为一次扫描，按命中的分支选择替换标点）
+        text = _REPEATED_PUNCT_RE.sub(lambda m: _REPEATED_PUNCT_REPL[m.lastindex - 1], text)
         
-        # 移除时间戳标记（如 [00:01:23]）
-        text = re.sub(r'\[\d{2}:\d{2}:\d{2}\]', '', text)
-        text = re.sub(r'\(\d{2}:\d{2}:\d{2}\)', '', text)
-        
-        # 移除识别置信度标记（如 (0.95)）
-        text = re.sub(r'\(0\.\d+\)', '', text)
+        # 移除时间戳标记（如 [00:01:23]）与识别置信度标记（如 (0.95)）
+        for probe, pattern in self._asr_mark_patterns:
+            if probe in text:
+                text = pattern.sub('', text)
         
         return text
     
@@ -125,6 +279,10 @@ class TextCleaner:
         """合并断裂的句子"""
         # 如果句子以逗号结尾且下一句很短，可能是断句错误
         lines = text.split('\n')
+        # 没有以逗号结尾的行时不需要合并，只去除各行首尾空白
+        if not _COMMA_LINE_END_RE.search(text):
+            return '\n'.join([line.strip() for line in lines])
+        
         merged = []
         i = 0
         while i < len(lines):
@@ -150,56 +308,68 @@ class TextCleaner:
     def _remove_duplicates(self, text: str) -> str:
         """去除重复的词和短语"""
         # 去除连续重复的词（如"很好很好" -> "很好"）
-        text = re.sub(r'(.{2,10})\1{2,}', r'\1', text)
+        # （重复单元最长 10 个字符，正则扫描为线性复杂度，且在 C 层完成，比逐字符的 Python 循环快）
+        text = _REPEATED_PHRASE_RE.sub(r'\1', text)
         
-        # 去除重复的短句
-        sentences = re.split(r'[。！？\n]', text)
+        # 去除重复的短句：逐句扫描，每句保留其后原有的句末标点与换行（去重后的文本仍按原样分行，不会合并为一行）
+        # （集合中保存的是句子字符串本身的引用；str 的哈希值计算一次后缓存在对象上）
         seen = set()
         cleaned_sentences = []
-        for sent in sentences:
-            sent = sent.strip()
+        for match in _SENTENCE_RE.finditer(text):
+            sent = match.group(1).strip()
             if sent and sent not in seen:
                 seen.add(sent)
-                cleaned_sentences.append(sent)
+                cleaned_sentences.append(sent + match.group(2))
+            else:
+                # 空白句或重复句不输出，但保留其后的换行，避免空行（分段边界）被吞掉、前后段落合并
+                newlines = match.group(2).lstrip('。！？')
+                if newlines:
+                    cleaned_sentences.append(newlines)
         
-        return '。'.join(cleaned_sentences)
+        return ''.join(cleaned_sentences)
     
     def _remove_filler_words(self, text: str) -> str:
         """去除语气词和口头禅"""
-        # 在句子开头和结尾去除
-        for word in self.filler_words:
-            # 开头
-            text = re.sub(rf'^{re.escape(word)}[，。、\s]*', '', text, flags=re.MULTILINE)
-            # 结尾
-            text = re.sub(rf'[，。、\s]*{re.escape(word)}$', '', text, flags=re.MULTILINE)
-            # 中间（保留标点）
-            text = re.sub(rf'[，。、\s]+{re.escape(word)}[，。、\s]+', '，', text)
+        # 一次扫描确认文本中没有任何语气词时，跳过三个正则
+        if self._filler_automaton is not None and next(self._filler_automaton.iter(text), None) is None:
+            return text
+        
+        # 开头
+        text = self._filler_start_re.sub('', text)
+        # 结尾
+        text = self._filler_end_re.sub('', text)
+        # 中间（保留标点）
+        text = self._filler_mid_re.sub('，', text)
         
         return text
     
     def _normalize_punctuation(self, text: str) -> str:
         """规范化标点符号"""
-        # 统一中文标点
-        replacements = {
-            '，': '，',
-            '。': '。',
-            '！': '！',
-            '？': '？',
-            '：': '：',
-            '；': '；',
-        }
-        
         # 确保句子以标点结尾
-        text = re.sub(r'([^。！？\n])(\n|$)', r'\1。\2', text)
+        if '\n' not in text:
+            # 不含换行的文本只有一个行尾，只需检查末尾一个字符
+            return text + '。' if text and text[-1] not in '。！？' else text
+        text = _MISSING_END_PUNCT_RE.sub(r'\1。\2', text)
         
         return text
     
     def _normalize_whitespace(self, text: str) -> str:
         """规范化空白字符"""
+        # 先用 str.translate 整体替换为空格（文本中没有这些字符时跳过）
+        if any(ch in text for ch in _SPACE_LIKE_CHARS):
+            text = text.translate(_SPACE_LIKE_TRANS)
+        
+        if '\n' not in text:
+            # 不含换行的文本：逐行去除首尾空白等价于整体 strip
+            text = text.strip()
+            return _MULTI_SPACE_RE.sub(' ', text) if '  ' in text else text
+        
         # 多个空格合并为一个
-        text = re.sub(r' +', ' ', text)
+        if '  ' in text:
+            text = _MULTI_SPACE_RE.sub(' ', text)
         # 多个换行合并为最多两个
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        if '\n\n\n' in text:
+            text = _MULTI_BLANK_RE.sub('\n\n', text)
         # 移除行首行尾空格
         lines = [line.strip() for line in text.split('\n')]
         return '\n'.join(lines)
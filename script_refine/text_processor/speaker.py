@@ -1,7 +1,58 @@
 """讲话人识别模块"""
 
 import re
-from typing import Optional, Dict, List
+from functools import lru_cache
+from typing import Optional, Dict, List, Set, Tuple
+
+
+def _build_line_sweep(patterns: Tuple[str, ...]) -> Optional["re.Pattern"]:
+    """
+    将各讲话人模式合并为一个多行正则，在整段文本中一次找出可能是讲话人标记的行
+    
+    用零宽前瞻匹配行首（跳过行首空白），不消耗字符，跨行的匹配不会吞掉后续行的行首。
+    含 $、\\A、\\Z 等依赖单行边界的模式无法等价合并，此时返回 None（逐行检测）。
+    """
+    alternatives = []
+    for pattern in patterns:
+        if any(anchor in pattern for anchor in ("$", "\\A", "\\Z")):
+            return None
+        # detect 对去除首尾空白的行做 match，行首的 ^ 由外层的 ^ 与空白前缀代替
+        alternatives.append(f"(?:{pattern[1:] if pattern.startswith('^') else pattern})")
+    if not alternatives:
+        return None
+    try:
+        return re.compile(rf"^[^\S\n]*(?={'|'.join(alternatives)})", re.MULTILINE)
+    except re.error:
+        return None
+
+
+def _build_fused(compiled: Tuple["re.Pattern", ...]) -> Optional["re.Pattern"]:
+    """
+    将各讲话人模式按顺序合并为一个分支正则，一次 match 得到第一个匹配的模式
+    
+    第 i 个模式包在第 i+1 个捕获组中，由 match.lastindex 得知命中的是哪个模式。
+    模式自带捕获组（组号会错位）或无法合并编译（如中间出现的全局内联标志）时返回 None（逐个匹配）。
+    """
+    if not compiled or any(pattern.groups for pattern in compiled):
+        return None
+    try:
+        return re.compile("|".join(f"({pattern.pattern})" for pattern in compiled))
+    except re.error:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _compile_patterns(
+    patterns: Tuple[str, ...]
+) -> Tuple[Tuple["re.Pattern", ...], Optional["re.Pattern"], Optional["re.Pattern"]]:
+    """
+    编译讲话人模式（按模式元组缓存，多个检测器实例共用）
+    
+    Returns:
+        (逐个编译的模式, 合并后的分支正则或 None, 合并后的行首扫描正则或 None)
+    """
+    compiled = tuple(re.compile(p) for p in patterns)
+    return compiled, _build_fused(compiled), _build_line_sweep(patterns)
 
 
 class SpeakerDetector:
@@ -15,7 +66,10 @@ class SpeakerDetector:
             r".*?:",
             r"^[A-Z].*?:",
         ])
-        self._compiled_patterns = [re.compile(p) for p in self.patterns]
+        # 相同的模式列表在多个实例间共用编译结果
+        self._compiled_patterns, self._fused_re, self._line_sweep_re = _compile_patterns(tuple(self.patterns))
+        # 按行缓存检测结果（同一讲话人标记反复出现时直接命中）
+        self._detect_line = lru_cache(maxsize=4096)(self._detect_line_uncached)
     
     def detect(self, text: str) -> Optional[str]:
         """
@@ -31,19 +85,73 @@ class SpeakerDetector:
             return None
         
         # 检查第一行
-        first_line = text.split('\n')[0].strip()
+        return self._detect_line(text.split('\n', 1)[0].strip())
+    
+    def _detect_line(self, line: str) -> Optional[str]:
+        """检测单行（已去除首尾空白）中的讲话人；__init__ 中替换为按实例带 LRU 缓存的版本"""
+        return self._detect_line_uncached(line)
+    
+    def _detect_line_uncached(self, line: str) -> Optional[str]:
+        """检测单行（已去除首尾空白）中的讲话人"""
+        start = 0
+        if self._fused_re is not None:
+            # 一次 match 找到第一个匹配的模式；其结果不是合理的讲话人名称时，从下一个模式起逐个匹配
+            match = self._fused_re.match(line)
+            if not match:
+                return None
+            speaker = self._clean_speaker(match.group(0))
+            if speaker:
+                return speaker
+            start = match.lastindex
         
-        for pattern in self._compiled_patterns:
-            match = pattern.match(first_line)
+        for pattern in self._compiled_patterns[start:]:
+            match = pattern.match(line)
             if match:
-                speaker = match.group(0).strip()
-                # 清理格式
-                speaker = speaker.strip('【】:：')
-                if speaker and len(speaker) < 50:  # 合理的讲话人名称长度
+                speaker = self._clean_speaker(match.group(0))
+                if speaker:
                     return speaker
         
         return None
     
+    @staticmethod
+    def _clean_speaker(matched: str) -> Optional[str]:
+        """清理匹配到的讲话人标记格式，不是合理的讲话人名称时返回 None"""
+        speaker = matched.strip().strip('【】:：')
+        if speaker and len(speaker) < 50:  # 合理的讲话人名称长度
+            return speaker
+        return None
+    
+    def marker_line_starts(self, text: str) -> Set[int]:
+        """
+        找出文本中讲话人标记行（detect 能识别出讲话人的行）的起始位置
+        
+        Args:
+            text: 输入文本
+            
+        Returns:
+            各讲话人标记行行首在 text 中的位置集合
+        """
+        if not self.enabled or not text:
+            return set()
+        
+        starts = set()
+        if self._line_sweep_re is None:
+            # 无法合并为一次扫描时逐行检测
+            line_start = 0
+            for line in text.split('\n'):
+                if self._detect_line(line.strip()):
+                    starts.add(line_start)
+                line_start += len(line) + 1
+            return starts
+        
+        # 一次扫描得到候选行，只对候选行调用 detect 确认（结果与逐行检测一致）
+        for match in self._line_sweep_re.finditer(text):
+            line_start = match.start()
+            line_end = text.find('\n', line_start)
+            if self._detect_line((text[line_start:line_end] if line_end != -1 else text[line_start:]).strip()):
+                starts.add(line_start)
+        return starts
+    
     def extract_all_speakers(self, text: str) -> List[str]:
         """
         提取文本中所有讲话人
@@ -54,11 +162,14 @@ class SpeakerDetector:
         Returns:
             讲话人列表
         """
+        if not self.enabled or not text:
+            return []
+        
         speakers = set()
         lines = text.split('\n')
         
         for line in lines:
-            speaker = self.detect(line)
+            speaker = self._detect_line(line.strip())
             if speaker:
                 speakers.add(speaker)
         
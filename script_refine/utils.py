@@ -0,0 +1,71 @@
+"""通用工具函数"""
+
+import re
+import time
+from functools import lru_cache
+
+
+# LLM 推理标记（<think>、<reasoning> 等，允许带属性，支持多行，忽略大小写）
+_REASONING_RE = re.compile(
+    r'<(think|reasoning|thought|internal|scratchpad|analysis|reflection)\b[^>]*>.*?</\1>',
+    re.DOTALL | re.IGNORECASE
+)
+# 连续三个及以上换行
+_MULTI_BLANK_RE = re.compile(r'\n{3,}')
+
+
+# 最近一次生成的时间戳（秒, 字符串），同一秒内直接复用
+_last_timestamp = (0, "")
+
+
+def fast_timestamp() -> str:
+    """
+    生成 YYYYmmdd_HHMMSS 格式的时间戳（同一秒内复用上次格式化结果）
+    
+    Returns:
+        时间戳字符串
+    """
+    global _last_timestamp
+    second = int(time.time())
+    cached_second, cached_str = _last_timestamp
+    if second != cached_second:
+        cached_str = time.strftime("%Y%m%d_%H%M%S", time.localtime(second))
+        # 元组整体赋值，多线程下不会读到秒数与字符串不一致的状态
+        _last_timestamp = (second, cached_str)
+    return cached_str
+
+
+def remove_reasoning_markers(text: str) -> str:
+    """
+    移除 LLM 推理过程标记（<think>...</think> 等），并清理留下的多余空行
+    
+    Args:
+        text: LLM 输出文本
+        
+    Returns:
+        移除推理标记后的文本
+    """
+    # 大多数输出不含标签或多余空行，先用子串判断跳过正则扫描；一次扫描处理所有标签
+    if '<' in text:
+        text = _REASONING_RE.sub('', text)
+    if '\n\n\n' in text:
+        text = _MULTI_BLANK_RE.sub('\n\n', text)
+    return text
+
+
+@lru_cache(maxsize=None)
+def read_prompt_file(path: str) -> str:
+    """
+    读取提示词文件（按路径缓存，重复创建重写器 / 纪要生成器时不再读盘）
+    
+    Args:
+        path: 提示词文件路径
+        
+    Returns:
+        文件内容
+        
+    Raises:
+        OSError: 文件不存在或无法读取（异常结果不会被缓存）
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
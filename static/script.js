@@ -174,7 +174,7 @@ async function processFile(file, mode) {
         
         if (data.success) {
             currentResults = data.results;
-            displayResults(data.results, mode, data.downloads);
+            displayResults(data.results, mode, data.downloads, data.truncated);
             showToast('处理完成！', 'success');
         } else {
             showToast(data.error || '处理失败', 'error');
@@ -187,8 +187,15 @@ async function processFile(file, mode) {
     }
 }
 
+// 下载按钮文字
+const DOWNLOAD_LABELS = {
+    docx: '📄 下载 Word',
+    pdf: '📕 下载 PDF',
+    markdown: '📝 下载 Markdown'
+};
+
 // 显示结果
-function displayResults(results, mode, downloads = {}) {
+function displayResults(results, mode, downloads = {}, truncated = {}) {
     outputSection.style.display = 'block';
     
     // 清空之前的内容
@@ -201,7 +208,7 @@ function displayResults(results, mode, downloads = {}) {
         const btn = document.createElement('button');
         btn.className = 'output-tab-btn active';
         btn.textContent = '完整版';
-        btn.onclick = () => showOutput('full', results.full);
+        btn.onclick = () => showOutput('full', results.full, truncated.full);
         outputTabs.appendChild(btn);
     }
     
@@ -209,19 +216,32 @@ function displayResults(results, mode, downloads = {}) {
         const btn = document.createElement('button');
         btn.className = 'output-tab-btn';
         btn.textContent = '会议纪要';
-        btn.onclick = () => showOutput('summary', results.summary);
+        btn.onclick = () => showOutput('summary', results.summary, truncated.summary);
         outputTabs.appendChild(btn);
     }
     
     // 显示第一个结果
     if (results.full) {
-        showOutput('full', results.full);
+        showOutput('full', results.full, truncated.full);
     } else if (results.summary) {
-        showOutput('summary', results.summary);
+        showOutput('summary', results.summary, truncated.summary);
     }
     
     // 创建下载按钮
-    if (results.full || results.summary) {
+    if (Object.keys(downloads).length > 0) {
+        // 上传文件：直接下载服务器已生成的文件（预览内容可能被截断）
+        for (const [formatType, filepath] of Object.entries(downloads)) {
+            const isSummary = formatType.startsWith('summary_');
+            const format = isSummary ? formatType.slice('summary_'.length) : formatType;
+            const btn = document.createElement('button');
+            btn.className = 'btn btn-download';
+            btn.textContent = (isSummary ? '会议纪要 ' : '') + (DOWNLOAD_LABELS[format] || format);
+            btn.onclick = () => {
+                window.location.href = `/api/download?path=${encodeURIComponent(filepath)}`;
+            };
+            downloadButtons.appendChild(btn);
+        }
+    } else if (results.full || results.summary) {
         const content = results.full || results.summary;
         
         // Word 下载
@@ -248,7 +268,7 @@ function displayResults(results, mode, downloads = {}) {
 }
 
 // 显示输出内容
-function showOutput(type, content) {
+function showOutput(type, content, truncated = false) {
     // 更新标签页状态
     document.querySelectorAll('.output-tab-btn').forEach(btn => {
         btn.classList.remove('active');
@@ -259,7 +279,9 @@ function showOutput(type, content) {
     });
     
     // 显示内容
-    outputContent.textContent = content;
+    outputContent.textContent = truncated
+        ? content + '\n\n……（内容较长，仅显示开头部分，完整内容请下载查看）'
+        : content;
 }
 
 // 导出文件
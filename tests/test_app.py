@@ -0,0 +1,91 @@
+"""Web 应用测试"""
+
+import app as web
+
+
+def test_batch_dispatcher_groups_requests_by_mode():
+    """同一时间窗口内的请求按处理模式分组，每组调用一次批处理函数"""
+    calls = []
+    dispatcher = web.BatchDispatcher(
+        lambda texts, mode: calls.append((mode, texts)) or [f"{mode}:{t}" for t in texts],
+        max_batch=8, max_latency_ms=50
+    )
+    futures = [dispatcher.submit(text, mode) for text, mode in [("甲", "full"), ("乙", "summary"), ("丙", "full")]]
+    dispatcher.start()
+
+    assert [f.result(timeout=5) for f in futures] == ["full:甲", "summary:乙", "full:丙"]
+    assert sorted(calls) == [("full", ["甲", "丙"]), ("summary", ["乙"])]
+
+
+def test_batch_dispatcher_does_not_wait_for_full_batch():
+    """凑不满一批时，最长等待 max_latency_ms 后即处理"""
+    dispatcher = web.BatchDispatcher(lambda texts, mode: texts, max_batch=8, max_latency_ms=10)
+    dispatcher.start()
+
+    assert dispatcher.submit("甲", "full").result(timeout=5) == "甲"
+
+
+def test_batch_dispatcher_propagates_handler_errors():
+    """批处理函数出错时，同组的所有请求都收到该异常"""
+    def handler(texts, mode):
+        raise RuntimeError("模型不可用")
+
+    dispatcher = web.BatchDispatcher(handler, max_latency_ms=10)
+    dispatcher.start()
+    future = dispatcher.submit("甲", "full")
+
+    assert isinstance(future.exception(timeout=5), RuntimeError)
+
+
+class StreamingRefiner:
+    """只实现 process_text_stream 的整理系统替身"""
+
+    def __init__(self, events, error=None):
+        self.events = events
+        self.error = error
+
+    def process_text_stream(self, text, output_mode="full"):
+        yield from self.events
+        if self.error:
+            raise self.error
+
+
+def read_sse(response):
+    """解析 SSE 响应中的事件"""
+    body = response.get_data(as_text=True)
+    return [web.app.json.loads(block[len("data: "):]) for block in body.split("\n\n") if block]
+
+
+def test_process_stream_emits_events_as_sse(monkeypatch):
+    """流式接口把每个事件编码为一条 data 行"""
+    events = [
+        {"type": "token", "chunk": 0, "total": 1, "content": "今天"},
+        {"type": "result", "content": "今天开会。"},
+    ]
+    monkeypatch.setattr(web, "refiner", StreamingRefiner(events))
+
+    response = web.app.test_client().post("/api/process_stream", json={"text": "今天开会", "mode": "full"})
+
+    assert response.mimetype == "text/event-stream"
+    assert read_sse(response) == events
+
+
+def test_process_stream_reports_errors_as_event(monkeypatch):
+    """处理中途出错时以 error 事件结束流"""
+    events = [{"type": "token", "chunk": 0, "total": 1, "content": "今天"}]
+    monkeypatch.setattr(web, "refiner", StreamingRefiner(events, RuntimeError("模型不可用")))
+
+    response = web.app.test_client().post("/api/process_stream", json={"text": "今天开会"})
+
+    received = read_sse(response)
+    assert received[:-1] == events
+    assert received[-1]["type"] == "error" and "模型不可用" in received[-1]["error"]
+
+
+def test_read_preview_truncates_long_files(tmp_path):
+    """预览只读取前 limit 个字符，并标记是否被截断"""
+    path = tmp_path / "result.md"
+    path.write_text("会议" * 10, encoding="utf-8")
+
+    assert web.read_preview(str(path), limit=5) == ("会议会议会", True)
+    assert web.read_preview(str(path), limit=20) == ("会议" * 10, False)
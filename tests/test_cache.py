@@ -0,0 +1,35 @@
+"""ResultCache 测试"""
+
+import os
+
+from script_refine.cache import ResultCache
+
+
+def test_set_and_get_round_trip(tmp_path):
+    """写入的值可以原样读回，不同键互不影响"""
+    cache = ResultCache({}, str(tmp_path))
+    key = cache.make_key("文本", "full")
+    cache.set(key, {"full": "整理结果"})
+
+    assert cache.get(key) == {"full": "整理结果"}
+    assert cache.get(cache.make_key("文本", "summary")) is None
+
+
+def test_set_unserializable_value_leaves_no_temp_file(tmp_path):
+    """值无法 JSON 序列化时放弃写入，不留下临时文件，也不抛出异常"""
+    cache = ResultCache({}, str(tmp_path))
+    key = cache.make_key("文本")
+    cache.set(key, {"value": object()})
+
+    assert cache.get(key) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    """超过 ttl 的缓存视为未命中"""
+    cache = ResultCache({"ttl": 10}, str(tmp_path))
+    key = cache.make_key("文本")
+    cache.set(key, "结果")
+    os.utime(cache._path(key), (0, 0))
+
+    assert cache.get(key) is None
@@ -0,0 +1,41 @@
+"""TextChunker 测试"""
+
+from script_refine.cache import ResultCache
+from script_refine.text_processor import TextChunker
+
+
+def test_token_cache_skips_long_texts():
+    """整篇文档等长文本不进入 token 数缓存，短段落照常缓存"""
+    chunker = TextChunker({"max_tokens": 100000})
+    long_text = "会" * (chunker._TOKEN_CACHE_MAX_CHARS + 1)
+
+    assert chunker.fits(long_text)
+    assert chunker._cached_count_tokens.cache_info().currsize == 0
+
+    chunker._count_tokens("短段落。")
+    chunker._count_tokens("短段落。")
+    info = chunker._cached_count_tokens.cache_info()
+    assert (info.currsize, info.hits) == (1, 1)
+
+
+def test_chunks_cache_key_depends_on_speaker_detection(tmp_path):
+    """讲话人识别开关或模式不同时，切片缓存键不同"""
+    cache = ResultCache({}, str(tmp_path))
+
+    def key(speaker_detection):
+        chunker = TextChunker({"speaker_detection": speaker_detection}, cache=cache)
+        return chunker._chunks_cache_key("张三：开会。")
+
+    assert key({"enabled": True}) != key({"enabled": False})
+    assert key({"patterns": [r"^(.+?)："]}) != key({"patterns": [r"^【(.+?)】"]})
+
+
+def test_semantic_split_of_ascii_text_keeps_spaces():
+    """纯 ASCII 长文本按长度切分时不丢失断点处的空格，拼接后与原文一致"""
+    chunker = TextChunker({})
+    text = "word " * 100
+
+    pieces = chunker._split_by_semantic_boundary(text)
+
+    assert len(pieces) > 1
+    assert "".join(pieces) == text
@@ -0,0 +1,42 @@
+"""TextCleaner 测试"""
+
+from script_refine.text_processor import TextCleaner
+
+
+def test_remove_duplicates_keeps_blank_line_between_paragraphs():
+    """只含空白的句子不输出，但其后的换行保留，空行分段不被合并"""
+    cleaner = TextCleaner({})
+    assert cleaner._remove_duplicates("A\n \nB") == "A\n\nB"
+    assert cleaner.clean("第一段。\n \n第二段。") == "第一段。\n\n第二段。"
+
+
+def test_remove_duplicates_keeps_paragraph_break_of_dropped_sentence():
+    """重复句被去除时，其后的空行仍保留，后续段落不并入上一段"""
+    cleaner = TextCleaner({})
+    assert cleaner._remove_duplicates("A。\n\nB。A。\n\nC") == "A。\n\nB。\n\nC"
+
+
+def test_clean_batch_dedupes_identical_texts():
+    """批量清洗时相同文本只清洗一次，结果按原顺序返回"""
+    cleaner = TextCleaner({})
+    calls = []
+    clean = cleaner.clean
+    cleaner.clean = lambda text: calls.append(text) or clean(text)
+    assert cleaner.clean_batch(["嗯，开会。", "散会。", "嗯，开会。"]) == ["开会。", "散会。", "开会。"]
+    assert calls == ["嗯，开会。", "散会。"]
+
+
+def test_remove_filler_words_at_start_end_and_between_commas():
+    """开头、结尾与逗号之间连续出现的语气词一次去除，长词优先匹配"""
+    cleaner = TextCleaner({})
+    assert cleaner._remove_filler_words("嗯，那个，今天开会。") == "今天开会。"
+    assert cleaner._remove_filler_words("今天开会嗯") == "今天开会"
+    assert cleaner._remove_filler_words("我们，就是那个，讨论一下。") == "我们，讨论一下。"
+    assert cleaner._remove_filler_words("怎么说呢我们开始吧") == "我们开始"
+
+
+def test_remove_duplicates_keeps_each_sentence_terminator():
+    """重复句只保留首次出现，保留的句子使用自己的句末标点"""
+    cleaner = TextCleaner({})
+    assert cleaner._remove_duplicates("今天开会。今天开会！散会。") == "今天开会。散会。"
+    assert cleaner._remove_duplicates("A！A。B？B？") == "A！B？"
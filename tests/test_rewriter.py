@@ -0,0 +1,116 @@
+"""TextRewriter 测试"""
+
+from script_refine.cache import ResultCache
+from script_refine.llm import BaseLLM
+from script_refine.rewriter import TextRewriter
+
+
+class EchoLLM(BaseLLM):
+    """原样返回提示词中的原文，并记录每次调用的原文"""
+
+    native_batch = True
+
+    def __init__(self, reply=None):
+        super().__init__({})
+        self.reply = reply
+        self.calls = []
+
+    def generate(self, prompt, system_prompt=None, **kwargs):
+        text = prompt.split("原始文本：\n", 1)[1].split("\n\n请输出", 1)[0]
+        self.calls.append(text)
+        return self.reply(text) if self.reply else text
+
+    def generate_stream(self, prompt, system_prompt=None, **kwargs):
+        yield self.generate(prompt, system_prompt, **kwargs)
+
+    def count_tokens(self, text):
+        return len(text)
+
+
+def make_rewriter(llm, fast_llm=None, max_tokens=1000):
+    return TextRewriter(llm, {"chunking": {"max_tokens": max_tokens}}, fast_llm=fast_llm)
+
+
+def test_batch_cascade_escalates_only_suspicious_chunks():
+    """批量重写先走快速模型，只有输出可疑（含拒答用语）的分片交给主模型"""
+    fast = EchoLLM(lambda text: "抱歉，无法处理" if "第二" in text else text)
+    main = EchoLLM()
+    rewriter = make_rewriter(main, fast)
+    chunks = [[{"text": "第一段内容。"}, {"text": "第二段内容。"}]]
+
+    assert rewriter._rewrite_chunk_lists(chunks) == [["第一段内容。", "第二段内容。"]]
+    assert fast.calls == ["第一段内容。", "第二段内容。"]
+    assert main.calls == ["第二段内容。"]
+
+
+def test_stream_cascade_uses_fast_model_when_output_is_fine():
+    """流式重写配置快速模型时，合格分片不调用主模型"""
+    fast = EchoLLM()
+    main = EchoLLM()
+    rewriter = make_rewriter(main, fast)
+
+    events = list(rewriter.rewrite_stream("今天开会。"))
+
+    assert events[-1] == {"type": "result", "content": "今天开会。"}
+    assert fast.calls == ["今天开会。"]
+    assert main.calls == []
+
+
+def test_stream_cascade_escalates_suspicious_output():
+    """流式重写时快速模型输出可疑，改为流式调用主模型"""
+    fast = EchoLLM(lambda text: "")
+    main = EchoLLM()
+    rewriter = make_rewriter(main, fast)
+
+    events = list(rewriter.rewrite_stream("今天开会。"))
+
+    assert [e["content"] for e in events if e["type"] == "token"] == ["今天开会。"]
+    assert main.calls == ["今天开会。"]
+
+
+def test_duplicate_chunks_are_rewritten_once():
+    """内容与讲话人相同的分片即使位置提示不同也只请求一次，结果复用到所有位置"""
+    main = EchoLLM()
+    main.native_batch = False
+    rewriter = make_rewriter(main)
+    rewriter.chunker.fits = lambda text: False
+    rewriter.chunker.chunk = lambda text: [
+        {"text": "开场白。"}, {"text": "正文内容。"}, {"text": "开场白。"}
+    ]
+
+    assert rewriter.rewrite("忽略", show_progress=False).count("开场白。") == 2
+    assert sorted(main.calls) == sorted(["开场白。", "正文内容。"])
+
+
+def test_batch_duplicate_chunks_are_rewritten_once():
+    """批量重写时不同文本、不同位置的相同分片只请求一次"""
+    main = EchoLLM()
+    rewriter = make_rewriter(main)
+    chunks = [[{"text": "开场白。"}, {"text": "甲。"}], [{"text": "乙。"}, {"text": "开场白。"}]]
+
+    assert rewriter._rewrite_chunk_lists(chunks) == [["开场白。", "甲。"], ["乙。", "开场白。"]]
+    assert sorted(main.calls) == sorted(["开场白。", "甲。", "乙。"])
+
+
+def test_close_only_removes_own_log_handlers(tmp_path):
+    """共用同一记录器的两个实例，关闭其中一个不影响另一个的日志处理器"""
+    config = {"logging": {"enabled": True, "output_to_console": False, "log_dir": str(tmp_path)}}
+    first = TextRewriter(EchoLLM(), config)
+    second = TextRewriter(EchoLLM(), config)
+    assert first.logger is second.logger
+
+    first.close()
+    assert first.logger.handlers == second._log_handlers != []
+
+    second.close()
+    assert second.logger.handlers == []
+
+
+def test_chunk_results_are_cached(tmp_path):
+    """相同分片再次重写时读取分片缓存，不再调用模型"""
+    main = EchoLLM()
+    rewriter = TextRewriter(main, {"temperature": 0.3}, cache=ResultCache({}, str(tmp_path)))
+
+    assert rewriter.rewrite("今天开会。", show_progress=False) == "今天开会。"
+    assert rewriter.rewrite("今天开会。", show_progress=False) == "今天开会。"
+    assert main.calls == ["今天开会。"]
@@ -0,0 +1,43 @@
+"""MeetingSummarizer 测试"""
+
+from script_refine.cache import ResultCache
+from script_refine.llm import BaseLLM
+from script_refine.summarizer import MeetingSummarizer
+
+
+class CountingLLM(BaseLLM):
+    """返回固定纪要并记录调用的提示词"""
+
+    def __init__(self):
+        super().__init__({})
+        self.prompts = []
+
+    def generate(self, prompt, system_prompt=None, **kwargs):
+        self.prompts.append(prompt)
+        return "<think>推理</think>纪要"
+
+    def count_tokens(self, text):
+        return len(text)
+
+
+def test_summarize_batch_dedupes_and_caches(tmp_path):
+    """批量生成时重复文本只请求一次，再次生成时直接读取缓存"""
+    llm = CountingLLM()
+    summarizer = MeetingSummarizer(llm, {"temperature": 0.3}, cache=ResultCache({}, str(tmp_path)))
+
+    assert summarizer.summarize_batch(["甲", "乙", "甲"]) == ["纪要", "纪要", "纪要"]
+    assert len(llm.prompts) == 2
+
+    assert summarizer.summarize_batch(["乙", "甲"]) == ["纪要", "纪要"]
+    assert summarizer.summarize("甲") == "纪要"
+    assert len(llm.prompts) == 2
+
+
+def test_summary_not_cached_at_high_temperature(tmp_path):
+    """温度高于缓存上限时不使用纪要缓存"""
+    llm = CountingLLM()
+    summarizer = MeetingSummarizer(llm, {"temperature": 0.7}, cache=ResultCache({}, str(tmp_path)))
+
+    summarizer.summarize("甲")
+    summarizer.summarize("甲")
+    assert len(llm.prompts) == 2